@@ -17,34 +17,43 @@ The programs contains the functions read_airport_codes, read_travel_file, unique
 importing relevant libraries
 '''
 
-import numpy as np
+import argparse
+import logging
+
 import pandas as pd
 
+from airport_index import build_airport_index, load_airport_index
+from airport_resolver import AirportResolver, AmbiguousAirportError
+from airport_store import load_airport_codes
+from instrumentation import RunRecorder, configure_logging
+from travel_reader import unique_travel_routes
+
 def read_airport_codes(filename: str) -> object:
     '''This function takes the file name as a string, reads the file and assigns it to a data frame:
 
     Inputs:
         str -- filename: the name of the file as a string
 
-    Returns: a Pandas dataframe object containing information in "airport_codes.csv"
+    Returns: a Pandas dataframe object containing information in "airport_codes.csv", read through the columnar airport store
     '''
-    air_codes_df = pd.read_csv(filename)
+    air_codes_df = load_airport_codes(filename)
     return air_codes_df
 
 def read_travel_file() -> object:
     '''
-    A function which takes the excel file it is handed, reads, it, and stores this information in a Pandas data frame.
+    A function which takes the excel file it is handed, reads, it, and stores this information in a Pandas data frame. The file is
+    read in chunks and only the unique Origination/Destination pairs are kept, as these are all unique_airports needs.
 
     Inputs:
         None
 
-    Returns: a Pandas data frame object with information from the travel file
+    Returns: a Pandas data frame object with the unique "Origination" and "Destination" pairs from the travel file
     '''
     name = 'JPM Airline Activity 7.1.2020 - 6.30.21 for Tom.xlsx' #alt code: input("Please enter the name of your travel file along with the file extension ")
-    travel_df = pd.read_excel(name)
+    travel_df = unique_travel_routes(name)
     return travel_df
 
-def unique_airports(travel_df) -> array:
+def unique_airports(travel_df) -> list:
     '''
     A function which identifies unique airports within the travel dataframe, then removes the unique airport identified by "---" (aka the placeholder Bates uses
     when the origin and/or destionation of a flight is unknown)
@@ -60,67 +69,89 @@ def unique_airports(travel_df) -> array:
     mod_unique_airports = [i for i in unique_airports if i != "---"] #takes out any origin/destination marked as "---"
     return mod_unique_airports
 
-def create_modif_airport_codes(air_codes_df: object, airports: list) -> object:
+def create_modif_airport_codes(air_codes_df: object, airports: list, airport_index: object = None, resolver: object = None) -> object:
 
     '''
         This function is the heart of the program. It identifies the indexes of the unique airports in the airports list it is handed in the air_codes_df.
         If the airport is not found, the length of the array which is to contain the indexes is zero; such indexes are dropped. If the array is longer than
-        zero, meaning that two potential rows in airport_codes.csv share the same local code or the same iata_code, the user must manually decipher the appropriate index
-        and input this. Otherwise, the index is assumed to be correct and appended to a list. A new data frame is initialized and the row
+        one, meaning that two potential rows in airport_codes.csv share the same local code or the same iata_code, the resolver picks the appropriate index
+        (see airport_resolver.py). Otherwise, the index is assumed to be correct and appended to a list. A new data frame is initialized and the row
         of each index in this new index list is appended to the new data frame.
 
         Inputs:
 
         object -- air_codes_df: the data frame containing information from airport_codes.csv
         airports -- list: the list of unique airports from the travel file
+        object -- airport_index: the AirportIndex for airport_codes.csv; built from air_codes_df if not provided
+        object -- resolver: the AirportResolver used when an airport matches several rows; ranks candidates using airport_overrides.csv if not provided
 
         Returns:
 
-            A csv file containing all information corresponding to unique airports in the travel file
+            A csv file containing all information corresponding to unique airports in the travel file; the same rows are returned as a data frame
 
     '''
 
-    aircodes_indx_list = []
-
-    for indx, airport in enumerate(airports):
-        aircodes_indx_val = air_codes_df[(air_codes_df["local_code"] == airports[indx]) | (air_codes_df["iata_code"] == airports[indx])].index.values #checks
-        #air_codes file to see if there are matches between it and any of the airports in the unique airports array for every airport in the
-        #unique airports array
-
-        aircodes_indx_val_as_list = aircodes_indx_val.tolist()
-
-        if (len(aircodes_indx_val_as_list)) == 0: #removes empty entries from the aircodes_indx_val_as_list array
-            del aircodes_indx_val_as_list
-
-        elif (np.size(aircodes_indx_val_as_list)) >= 2: #if the length of an entry in the array is greater than one (meaning two indeces were identified), pick one
-            correct_index = int(input(f'{aircodes_indx_val_as_list} These indeces represent rows in "airport_codes" that were identified by the program as corresponding\
-            to origins in the business travel file you entered. Please review the airport_codes file and input the index of the correct origin '))
-            aircodes_indx_val_as_list = [correct_index]
-            aircodes_indx_list.append(aircodes_indx_val_as_list)
+    if airport_index is None:
+        airport_index = build_airport_index(air_codes_df)
 
-        else:
-            aircodes_indx_list.append(aircodes_indx_val_as_list) #otherwise, keep the entry
+    if resolver is None:
+        resolver = AirportResolver(air_codes_df)
 
+    aircodes_indx_list = []
 
-    new_df = pd.DataFrame(index = np.arange(len(aircodes_indx_list)-1), columns=['','ident','type','name','elevation_ft','continent','iso_country',
-    'iso_region', 'municipality', 'gps_code', 'iata_code', 'local_code', 'coordinates']) #creating a new data frame with the same strucutre as "airport_codes.csv"
-
-    for code in range(0, len(aircodes_indx_list)-1):
-        value = aircodes_indx_list[code][0] #value is an integer, it pulls an integer out of a list, code, within a larger list aircodes_indx_list
-        row = (air_codes_df.iloc[[value]]) #pull out all information in the row with index "value"
-        row_df = pd.DataFrame(row) #create a new dataframe for this new row
-        row_df = row_df.reset_index()
-        row_df.drop(row_df.columns[[0]], axis=1, inplace=True) #reset the index for this data frame to remove an additional column that pops up populated by "value"
-        #row_df.to_csv("row2.csv")
-        new_df.iloc[code] = row_df
-    new_df.to_csv("modified_air_codes.csv", index = False) #create the new csv file without a standard index column starting at 0 
-
-
-def main():
-
-    air_codes_df = read_airport_codes("airport_codes.csv")
-    travel_df = read_travel_file()
-    airports = unique_airports(travel_df)
-    modified_air_codes_df = create_modif_airport_codes(air_codes_df, airports)
-
-main()
+    for indx, airport in enumerate(airports):
+        aircodes_indx_val_as_list = airport_index.lookup(airports[indx]) #checks the index of the air_codes file to see if there are
+        #matches between it and any of the airports in the unique airports array for every airport in the unique airports array
+
+        correct_index = resolver.resolve(airports[indx], aircodes_indx_val_as_list) #if two or more indeces were identified, the resolver
+        #picks one using the overrides file or its ranking instead of asking the user
+
+        if correct_index is None: #the airport was not found (or, in strict mode, is ambiguous and will be reported below); such entries are dropped
+            continue
+
+        aircodes_indx_list.append([correct_index])
+
+    resolver.raise_for_ambiguities()
+
+    aircodes_rows = list(dict.fromkeys(row[0] for row in aircodes_indx_list)) #pulls the integer out of each one-element list; two airports
+    #resolving to the same row are only kept once
+    new_df = air_codes_df.iloc[aircodes_rows] #a new data frame with the same strucutre as "airport_codes.csv" holding the row of each index
+    new_df.to_csv("modified_air_codes.csv", index = True, index_label = None) #the first, unnamed column holds the index of the row in
+    #airport_codes.csv, which is how Update_Travel_File_and_Calculate_Emissions.py reads the file (index_col = 0)
+    return new_df
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description="Create modified_air_codes.csv from the airports in the travel file.")
+    parser.add_argument("--log-level", default="INFO", help="DEBUG, INFO or WARNING")
+    parser.add_argument("--report", default="run_report.json", help="JSON file for the stage timings and memory of this run")
+    parser.add_argument("--deep", action="store_true", help="also capture cProfile statistics and tracemalloc allocation sites")
+    parser.add_argument("--strict", action="store_true", help="stop with a list of every airport code matching several airports "
+    "instead of picking one; add the right airport for each to airport_overrides.csv")
+    options = parser.parse_args(args)
+    configure_logging(options.log_level)
+    recorder = RunRecorder("Create_Truncated_Codes_File_FINAL", deep = options.deep)
+
+    with recorder.stage("read_airport_codes") as stage:
+        air_codes_df = read_airport_codes("airport_codes.csv")
+        stage["rows"] = len(air_codes_df)
+    with recorder.stage("read_travel_file") as stage:
+        travel_df = read_travel_file()
+        stage["rows"] = len(travel_df)
+    with recorder.stage("unique_airports") as stage:
+        airports = unique_airports(travel_df)
+        stage["rows"] = len(airports)
+    with recorder.stage("load_airport_index"):
+        airport_index = load_airport_index("airport_codes.csv")
+    with recorder.stage("create_modif_airport_codes") as stage:
+        try:
+            modified_air_codes_df = create_modif_airport_codes(air_codes_df, airports, airport_index, AirportResolver(air_codes_df, strict = options.strict))
+        except AmbiguousAirportError as error:
+            logging.getLogger(__name__).error(f"{error}:\n{error.report.to_string()}")
+            raise SystemExit(1)
+        stage["rows"] = len(modified_air_codes_df)
+    logging.getLogger(__name__).info(f"modified_air_codes.csv written with {len(modified_air_codes_df)} airports")
+    recorder.write_report(options.report)
+
+if __name__ == "__main__":
+    main()
@@ -6,15 +6,36 @@ The aim of this program is to calculate flight emissions. It does this by readin
 determining whether or not the airports listed in the business travel file sheet exists in a sheet with
 airport information (including coordinates), and updating the airport information sheet "modified_air_codes.csv"
 if an origin or destination airport is not included using airport_codes.csv. After all relevant information is
-obtained, flight distances are calculated using a triple for loop and Numpy arrays; finally, these
-distances are multiplied by the appropriate emissions factor to determine kgs of CO2 and tons of CO2 for
-all flights.
+obtained, flight distances are calculated for all flights at once using Numpy arrays; finally, these
+distances are placed in haul bands and multiplied by the appropriate emissions factor to determine kgs of CO2
+and tons of CO2 for every flight and for all flights.
 
 '''
 
+import argparse
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 import pandas as pd
 import numpy as np
-import math
+
+from airport_fallback import DEFAULT_FALLBACK_FILE, AirportFallback, collect_code_aliases, save_fallbacks
+from airport_index import build_airport_index, load_airport_index
+from airport_resolver import AirportResolver, AmbiguousAirportError
+from airport_store import load_airport_codes
+from emissions import EMISSION_BANDS, classify_emissions, summarize_emissions
+from flight_distance import DISTANCE_MODELS, HAVERSINE, DistanceModel, build_coordinate_lookup, calculate_distances, distances_from_lookup
+from instrumentation import RunRecorder, configure_logging
+from route_cache import DEFAULT_CACHE_FILE, RouteDistanceCache, route_cache_file
+from travel_reader import COUNT_COLUMN, DEFAULT_CHUNK_ROWS, TRAVEL_COLUMNS, count_travel_routes
+from travel_rollups import ROLLUPS, aggregate_segments, combine_rollups, prepare_rollup_columns, rollup_source_columns, write_rollups
+
+KNOWN_CODES_SUFFIX = ".codes.json" #the known codes of "modified_air_codes.csv" are kept in "modified_air_codes.csv.codes.json"
+
+logger = logging.getLogger(__name__)
 
 def read_travel_file() -> object:
     '''
@@ -29,7 +50,60 @@ def read_travel_file() -> object:
     travel_file_df = pd.read_excel(name)
     return travel_file_df
 
-def update_modified_aircodes_file(travel_df: object, modified_aircodes_file_df: object, air_codes_df: object) -> object:
+def find_missing_airport_rows(missing_airports: list, air_codes_df: object, airport_index: object = None, resolver: object = None,
+fallback: object = None) -> tuple:
+
+    '''
+        Function that finds the row of airport_codes.csv for each airport missing from modified_air_codes.csv.
+
+        Inputs:
+            list -- missing_airports: airport codes from the travel file that are not in modified_air_codes.csv
+            obj -- air_codes_df: the airport_codes.csv data frame with all international airports
+            obj -- airport_index: the AirportIndex for airport_codes.csv; built from air_codes_df if not provided
+            obj -- resolver: the AirportResolver used when an airport matches several rows; ranks candidates using airport_overrides.csv if not provided
+            obj -- fallback: an optional airport_fallback.AirportFallback used for airports that match no row at all; its matches are
+            recorded in fallback.matches
+
+        Returns:
+            A tuple (rows_in_aircodes_final, removal_list): a list of one-element lists holding the airport_codes.csv index of each airport
+            that was found, in the order of missing_airports, and the list of airports that could not be found
+    '''
+
+    if airport_index is None:
+        airport_index = build_airport_index(air_codes_df)
+    if resolver is None:
+        resolver = AirportResolver(air_codes_df)
+
+    rows_in_aircodes = []
+    removal_list = []
+
+    for index in range(0, len(missing_airports)):
+
+        com_aircodes_indx_val = np.array(airport_index.lookup(missing_airports[index]), dtype=int) #get the indeces of the missing airport
+        #in airport_codes.csv's data frame air_codes_df where there is a local_code OR iata_code match; a row matching on both is listed once
+
+        correct_index = resolver.resolve(missing_airports[index], com_aircodes_indx_val.tolist()) #recall that some airprots have the same
+        #iata_code or local_code and can therefore have two indeces in airport codes; the resolver picks one using the overrides file or its
+        #ranking instead of asking the user
+
+        if correct_index is None and len(com_aircodes_indx_val) == 0 and fallback is not None:
+            fallback_match = fallback.resolve(missing_airports[index]) #try a close code or name match before giving up on the airport
+            if fallback_match is not None:
+                correct_index = fallback_match.row
+                logger.warning(f'{missing_airports[index]} is not in airport_codes.csv; using {fallback_match.ident} ({fallback_match.method} match)')
+
+        if correct_index is None:
+            removal_list.append(missing_airports[index]) #append to the removal list those airports in the travel file which could not be found
+        else:
+            rows_in_aircodes.append([correct_index])
+
+    resolver.raise_for_ambiguities() #in strict mode, stop here with a report of every ambiguous airport rather than one at a time
+
+    rows_in_aircodes_final = [i for i in rows_in_aircodes if i != []] #remove those airport entries that appear as [] in rows_in_aircodes_final
+    return rows_in_aircodes_final, removal_list
+
+def update_modified_aircodes_file(travel_df: object, modified_aircodes_file_df: object, air_codes_df: object, airport_index: object = None,
+resolver: object = None, filename: str = "modified_air_codes.csv", fallback: object = None) -> object:
 
     '''
         Function that updates the existing modified_air_codes.csv with any airports found in the travel file that do not
@@ -39,6 +113,10 @@ def update_modified_aircodes_file(travel_df: object, modified_aircodes_file_df:
             obj -- travel_df: the travel file's dataframe
             obj -- modified_air_codes_file_df: the modified_air_codes.csv data frame
             obj -- air_codes_df: the airport_codes.csv data frame with all international airports
+            obj -- airport_index: the AirportIndex for airport_codes.csv; built from air_codes_df if not provided
+            obj -- resolver: the AirportResolver used when an airport matches several rows; ranks candidates using airport_overrides.csv if not provided
+            str -- filename: the modified airport codes file to write
+            obj -- fallback: an optional airport_fallback.AirportFallback used for airports not in airport_codes.csv
 
         Returns:
             An updated data frame contianing all airports in the business travel file
@@ -56,8 +134,9 @@ def update_modified_aircodes_file(travel_df: object, modified_aircodes_file_df:
     unique_mod_trav_airports = [i for i in short_mod_trav_array if i != '---'] #list comprehension to remove an airport deemed as unique that is
     #actually a blank entry; a precautionary measure in this case that will likely not be of issue
 
+    unique_mod_trav_airports = set(unique_mod_trav_airports) #a set makes each membership check below O(1)
     missing_airports = [i for i in unique_trav_airports if i not in unique_mod_trav_airports]
-    print(f'The missing airports include {missing_airports}. Note the index where each airport first occurs in the travel file in case of conflicts')
+    logger.info(f'The missing airports include {missing_airports}. Note the index where each airport first occurs in the travel file in case of conflicts')
     #this will pull out any airprots that were in the new business travel file but not in the modified_air_codes.csv file
 
     if len(missing_airports) == 0: #Essentially this says that if no missing airports are identified, exit out of this function
@@ -65,38 +144,8 @@ def update_modified_aircodes_file(travel_df: object, modified_aircodes_file_df:
 
     else:
 
-        rows_in_aircodes = []
-        removal_list = []
-
-        for index in range(0, len(missing_airports)):
-
-            aircodes_indx_val = air_codes_df[(air_codes_df["local_code"] == missing_airports[index]) |
-            (air_codes_df["iata_code"] == missing_airports[index])].index.values #get the index of the missing airport in airport_codes.csv's
-            #data frame air_codes_df where there is a local_code OR iata_code match
-
-
-            additional_indx_val = air_codes_df[(air_codes_df["local_code"] == missing_airports[index]) &
-            (air_codes_df["iata_code"] == missing_airports[index])].index.values #get the index of the missing airport in airport_codes.csv's
-            #data frame air_codes_df where there is a local_code AND an iata_code match
-
-            com_aircodes_indx_val = np.concatenate((aircodes_indx_val, additional_indx_val)) #create a composite list of indeces in the
-            #aircodes_df where missing indeces were found
-
-            if len(com_aircodes_indx_val.copy()) == 0:
-                removal_list.append(missing_airports[index]) #append to the removal list those airports in the travel file which could not be found
-            if len(com_aircodes_indx_val.copy()) >= 2:
-                print(f'Indeces to choose between are {com_aircodes_indx_val}')
-                correct_index = int(input("Please enter the correct airport index in airport_codes.csv corresponding to the airport in missing airports "))
-                rows_in_aircodes.append([correct_index]) #ask the user to manually input the index of the airport in airport_codes.csv (index, not row!) where
-                #the correct missing airport has been identified. Recall that some airprots have the same iata_code or local_code and can therefore have
-                #two indeces in airport codes
-            else:
-                rows_in_aircodes.append(com_aircodes_indx_val.tolist()) #if the length of the index list potential entry is one, append it as this
-                #means there are no conflicts with regard to local/iata_code
-
-        rows_in_aircodes_new = [i for i in rows_in_aircodes if i not in removal_list] #create a new list containing the rows of airports that could actually be found
-        rows_in_aircodes_final = [i for i in rows_in_aircodes if i != []] #remove those airport entries that appear as [] in rows_in_aircodes_final
-        print(rows_in_aircodes_final)
+        rows_in_aircodes_final, removal_list = find_missing_airport_rows(missing_airports, air_codes_df, airport_index, resolver, fallback)
+        logger.debug(f'Rows of airport_codes.csv added: {rows_in_aircodes_final}')
 
 
         new_df = pd.DataFrame()
@@ -107,140 +156,177 @@ def update_modified_aircodes_file(travel_df: object, modified_aircodes_file_df:
             #file to a new data frame after it is found
 
         final_df = pd.concat([modified_aircodes_file_df, new_df]) #concatenate the new dataframe to the existing dataframe
-        final_df.to_csv("modified_air_codes.csv", index = True, index_label = None) #replace modified_air_codes.csv wth the version containing new lines with new airports
-        returned_df = pd.read_csv("modified_air_codes.csv", index_col = 0)
+        final_df.to_csv(filename, index = True, index_label = None) #replace modified_air_codes.csv wth the version containing new lines with new airports
+        returned_df = pd.read_csv(filename, index_col = 0)
         return returned_df
 
+def load_known_codes(filename: str = "modified_air_codes.csv", modified_aircodes_file_df: object = None) -> set:
+
+    '''
+        Function that loads the set of airport codes already covered by modified_air_codes.csv. The set is kept in a small json file next to
+        modified_air_codes.csv together with the modification time and size of modified_air_codes.csv; if the csv file was changed by something
+        else (e.g. edited by hand) the set is rebuilt from its local_code and iata_code columns.
+
+        Inputs:
+            str -- filename: the modified airport codes file
+            obj -- modified_aircodes_file_df: the modified_air_codes.csv data frame, if already loaded; only used when the set is rebuilt
+
+        Returns:
+            A set of airport codes
+    '''
+
+    stat = os.stat(filename)
+    known_codes_file = filename + KNOWN_CODES_SUFFIX
+    if os.path.exists(known_codes_file):
+        with open(known_codes_file) as file:
+            known_codes = json.load(file)
+        if known_codes.get("mtime_ns") == stat.st_mtime_ns and known_codes.get("size") == stat.st_size:
+            return set(known_codes["codes"])
+
+    if modified_aircodes_file_df is None:
+        modified_aircodes_file_df = pd.read_csv(filename, index_col = 0)
+    codes = set(pd.concat([modified_aircodes_file_df['local_code'], modified_aircodes_file_df['iata_code']]).dropna())
+    codes.discard('---')
+    save_known_codes(codes, filename)
+    return codes
+
+def save_known_codes(codes: set, filename: str = "modified_air_codes.csv"):
+
+    '''
+        Function that saves the set of airport codes covered by modified_air_codes.csv, stamped with the current modification time and size of
+        modified_air_codes.csv.
+
+        Inputs:
+            set -- codes: the airport codes
+            str -- filename: the modified airport codes file
+    '''
+
+    stat = os.stat(filename)
+    with open(filename + KNOWN_CODES_SUFFIX, "w") as file:
+        json.dump({"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "codes": sorted(codes)}, file)
+
+def append_modified_aircodes_file(travel_df: object, modified_aircodes_file_df: object, air_codes_df: object, airport_index: object = None,
+resolver: object = None, filename: str = "modified_air_codes.csv", fallback: object = None, code_aliases: dict = None) -> object:
+
+    '''
+        Incremental version of update_modified_aircodes_file. The new airports are found with set operations against the persisted set of
+        known codes, only their rows are appended to modified_air_codes.csv, and the file is neither rewritten nor read back. When the travel
+        file has no new airports nothing is written at all. Only the local_code and iata_code of the rows in the file are recorded as known,
+        as those are the codes the distance stage can find; a code resolved through an override or the fallback is looked up again on
+        later runs unless code_aliases already points it at an airport in the file.
+
+        Inputs:
+            obj -- travel_df: the travel file's dataframe (only the Origination and Destination columns are used)
+            obj -- modified_air_codes_file_df: the modified_air_codes.csv data frame
+            obj -- air_codes_df: the airport_codes.csv data frame with all international airports
+            obj -- airport_index: the AirportIndex for airport_codes.csv; built from air_codes_df if not provided
+            obj -- resolver: the AirportResolver used when an airport matches several rows; ranks candidates using airport_overrides.csv if not provided
+            str -- filename: the modified airport codes file to append to
+            obj -- fallback: an optional airport_fallback.AirportFallback used for airports not in airport_codes.csv
+            dict -- code_aliases: codes mapped to the ident of the airport to use, as passed to flight_distance.build_coordinate_lookup
+
+        Returns:
+            An updated data frame contianing all airports in the business travel file
+    '''
+
+    known_codes = load_known_codes(filename, modified_aircodes_file_df)
+    travel_codes = set(pd.concat([travel_df['Origination'], travel_df['Destination']]).dropna())
+    travel_codes.discard('---')
+    file_idents = set(modified_aircodes_file_df['ident'])
+    aliased_codes = {code for code, ident in (code_aliases or {}).items() if ident in file_idents}
+    missing_airports = sorted(travel_codes - known_codes - aliased_codes) #sorted so that runs over the same travel file append rows in the same order
+    if len(missing_airports) == 0:
+        return modified_aircodes_file_df
+
+    logger.info(f'The missing airports include {missing_airports}')
+    rows_in_aircodes_final, removal_list = find_missing_airport_rows(missing_airports, air_codes_df, airport_index, resolver, fallback)
+    found_airports = [airport for airport in missing_airports if airport not in set(removal_list)]
+    if len(found_airports) == 0: #none of the new airports are in airport_codes.csv; they are looked up again next run in case it changes
+        return modified_aircodes_file_df
+
+    new_rows = []
+    existing_rows = set(modified_aircodes_file_df.index)
+    for row in rows_in_aircodes_final:
+        if row[0] not in existing_rows: #two codes can resolve to the same airport, or to one the file already has
+            new_rows.append(row[0])
+            existing_rows.add(row[0])
+
+    new_df = air_codes_df.iloc[new_rows].reindex(columns = modified_aircodes_file_df.columns)
+    append_airport_rows(new_df, filename, known_codes)
+    return pd.concat([modified_aircodes_file_df, new_df])
+
+def append_airport_rows(new_df: object, filename: str = "modified_air_codes.csv", known_codes: set = None):
+
+    '''
+        Function that appends rows of airport_codes.csv to modified_air_codes.csv and records their local_code and iata_code in the set of
+        known codes.
+
+        Inputs:
+            obj -- new_df: the rows to append, with the columns of modified_air_codes.csv and indexed by row of airport_codes.csv
+            str -- filename: the modified airport codes file to append to
+            set -- known_codes: the known codes of filename, as returned by load_known_codes; loaded if not provided
+    '''
+
+    if known_codes is None:
+        known_codes = load_known_codes(filename)
+    if len(new_df) != 0:
+        with open(filename, "rb+") as file: #make sure the appended rows start on a new line, even if the file was edited by hand
+            file.seek(0, os.SEEK_END)
+            if file.tell() > 0:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    file.write(b"\n")
+        new_df.to_csv(filename, mode = "a", header = False, index = True)
+
+    known_codes.update(new_df['local_code'].dropna())
+    known_codes.update(new_df['iata_code'].dropna())
+    save_known_codes(known_codes, filename)
+
 
 ################################################################################
 
 
-def calculate_flight_distance(alt_travel_df: object, short_air_df: object) -> list:
+def calculate_flight_distance(alt_travel_df: object, short_air_df: object, distance_model: object = HAVERSINE) -> list:
     '''
         The purpose of this function is to find the coordinates of airports in the short_air_df where an airport matches one
-        inside the alt_travel_df. After coordinates are found for the "Origination" and "Destination" airport, the Haversine formula
-        for a spherical object is used to calculate travel distance.
+        inside the alt_travel_df. After coordinates are found for the "Origination" and "Destination" airport, the distance model
+        (by default the Haversine formula for a spherical object) is used to calculate travel distance. All codes are resolved to
+        coordinate arrays in one pass and every distance is computed at once by flight_distance.calculate_distances.
 
         Inputs:
             obj -- alt_travel_df: the travel data frame with just the Origination and Destination columns of the travel file
             obj -- short_air_df: the newly updated airport information file with all relevant airports from the airport_codes.csv file
+            obj -- distance_model: the flight_distance.DistanceModel used, e.g. DistanceModel("vincenty") for the WGS-84 ellipsoid
 
         Returns:
-            An array of flight distances
+            A list of flight distances in miles; flights whose origin or destination could not be found (including "---") are NaN
     '''
 
-    orig_arr = alt_travel_df["Origination"].to_numpy()
-    dest_arr = alt_travel_df["Destination"].to_numpy()
-    coord_arr = short_air_df["coordinates"].to_numpy()
-
-    flight_distance_list = []
-    for i in range(0, len(orig_arr)):
-        origin_airport = orig_arr[i]
-        dest_airport = dest_arr[i]
-        #print(origin_airport) working
-        #print(dest_airport) working
-        #print(len(coord_arr))
-
-
-        orig_lattitude = ""
-        origin_longitude = ""
-        dest_lattitude = ""
-        dest_longitude = ""
-
-
-        for j in range(0, len(coord_arr)):
-
-            if (((origin_airport == short_air_df.at[j, "local_code"]) | (origin_airport == short_air_df.at[j, "iata_code"])) | (
-            (origin_airport == short_air_df.at[j, "local_code"]) & (origin_airport == short_air_df.at[j, "iata_code"])
-            )): #essentially, find where the airport in the origin array has a match in the short_air_df data frame
-                o_row_of_interest = j #the row where the match occurs
-                coordinate_set_1 = short_air_df.at[o_row_of_interest, "coordinates"] #the coordinates in the row where the match occurs
-                o_comma_indx = coordinate_set_1.find(",")
-                orig_longitude = coordinate_set_1[0: o_comma_indx]
-                orig_lattitude = coordinate_set_1[o_comma_indx+1: (len(coordinate_set_1)+1)]
-                #print(f"The origin lattitude is {orig_lattitude}")
-                #print(f"The origin longitude is {orig_longitude}")
-                #input()
-                #print(coord_arr[index]) cx
-                #print(f"The origin lattitude is {orig_lattitude}")
-                #print(f"The origin longitude is {orig_longitude}")
-
-                for k in range(0, len(coord_arr)): #now that we have moved through the origin column, we need to find out information
-                #about the destination for the origin airport located at row j in the short_air_df; to do so, we employ a for loop
-                #which enables us to keep the origin airport information while moving through the short_air_df to find a match for the
-                #destination in the same row as the origin
-
-                    if ((dest_airport == short_air_df.at[k, "local_code"]) | (dest_airport == short_air_df.at[k, "iata_code"])) | (
-                    (dest_airport == short_air_df.at[k, "local_code"]) & (dest_airport == short_air_df.at[k, "iata_code"])
-                    ): #essentially find where there is a match between the destination at row i in the travel file and
-                    #the airport at row k in the short_air_df file
-
-                        d_row_of_interest = k #the row where the match occurs
-                        coordinate_set_2 = short_air_df.at[d_row_of_interest, "coordinates"] #coordinates in the row where the match occurs
-                        d_comma_indx = coordinate_set_2.find(",")
-                        dest_longitude = coordinate_set_2[0: d_comma_indx]
-                        dest_lattitude = coordinate_set_2[d_comma_indx+1: (len(coordinate_set_2)+1)]
-                        #print(f"The destination lattiude is {dest_lattitude}")
-                        #print(f"The destination longitude is {dest_longitude}")
-
-
-                        if ((orig_lattitude != "" and orig_longitude != "") or (dest_lattitude != "" and dest_longitude != "")) or (orig_lattitude != dest_lattitude):
-                            #the purpose of this line is to not concern ourselves with cases where information can not be found about the airport at index i. This
-                            #can happen if the airport is not in short_air_df because it was also not in airport_codes.csv or if the line is blank "---"
-
-                            #print(orig_lattitude)
-                            #print(orig_longitude)
-                            #print(dest_lattitude)
-                            #print(dest_longitude)
-
-                            #working for test case on Esri https://community.esri.com/t5/coordinate-reference-systems-blog/distance-on-a-sphere-the-haversine-formula/ba-p/902128
-                            #but their printed distance is incorrect
-
-                            orig_latt_rad = np.radians(float(orig_lattitude)) #coordinates always come in degree pairs, so we must convert our data to radians
-                            print(f" lat1 = {orig_latt_rad}")
-                            dest_latt_rad = np.radians(float(dest_lattitude))
-                            print(f" lat2 = {dest_latt_rad}")
-                            orig_long_rad = np.radians(float(orig_longitude))
-                            print(f" long1 = {orig_long_rad}")
-                            dest_long_rad = np.radians(float(dest_longitude))
-                            print(f" long2 = {dest_long_rad}")
-                            #delta_latt = np.radians(float(dest_lattitude) - float(orig_lattitude))
-                            #delta_long = np.radians(float(dest_longitude) - float(orig_longitude))
-                            #Haversine Fomula link: https://www.movable-type.co.uk/scripts/latlong.html
-                            a = np.sin((dest_latt_rad-orig_latt_rad)/2.0)**2 + \
-                            np.cos(orig_latt_rad) * np.cos(dest_latt_rad) * np.sin((dest_long_rad-orig_long_rad)/2.0)**2
-                            #print(a)
-                            c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
-                            d = 6371*c #all calculations are about correct with variation due to formula used and also selection of earth radius size
-                            #print(d)
-                            print(d)
-                            if d != 0.0:
-                                d_miles = d/1.60934
-
-                            #Alt choice would be to use Vincenty's formula (https://www.calculator.net/distance-calculator.html?type=3&la1=-0.116773&lo1=38.889931&la2=-77.009003&lo2=51.510357&ctype=dec&lad1=38&lam1=53&las1=51.36&lau1=n&lod1=77&lom1=2&los1=11.76&lou1=w&lad2=39&lam2=56&las2=58.56&lau2=n&lod2=75&lom2=9&los2=1.08&lou2=w&x=91&y=29#latlog);
-                            #note that Haversine formula can be quite inaccurate for large distances
-
-        flight_distance_list.append(d_miles)
-        #print(flight_distance_list)
-
-    return flight_distance_list
-
-            #df.insert(0, "col0", pd.Series([5, 6], index=[1, 2]))
-
-def calculate_emissions(travel_df, new_modified_aircodes_file_df):
+    distances = calculate_distances(alt_travel_df["Origination"].to_numpy(), alt_travel_df["Destination"].to_numpy(), short_air_df,
+    distance_model)
+    #note that the Haversine formula can be off by up to about 0.5% for long hauls; DistanceModel("vincenty") uses Vincenty's formula instead
+
+    return distances.tolist()
+
+
+def calculate_emissions(travel_df, new_modified_aircodes_file_df, bands = EMISSION_BANDS, distance_model = HAVERSINE):
 
     '''
         The goal of this function is to calculate emissions using the flight_distance list obtained from the calculate_flight_distance function;
-        emissions factors are from the EPA and are in kg C02 per mile.
+        emissions factors are from the EPA and are in kg C02 per mile. All flights are placed in a haul band at once by emissions.classify_emissions.
 
         Inputs:
 
         obj -- travel_df: the travel data from the travl file as a dataframe
         obj -- new_modified_aircodes_file_df: data frame contianing information from airport_codes.csv that was added to modified_air_codes.csv
         in the case where there were missing airports that occured in the travel file but not modified_air_codes.to_csv
+        obj -- bands: the table of haul bands and emissions factors, emissions.EMISSION_BANDS by default
+        obj -- distance_model: the flight_distance.DistanceModel used for the flight distances
 
         Returns:
-            None; just prints kg CO2 for Bates
+            A tuple (segments_df, summary_df): every column of travel_df followed by the distance, band, kg CO2 and tonnes CO2 of
+            every flight, and the totals for each band. The travel columns are carried through so that segments_df can be
+            passed to travel_rollups.rollup_emissions or travel_rollups.assign_itineraries
 
     '''
 
@@ -248,29 +334,224 @@ def calculate_emissions(travel_df, new_modified_aircodes_file_df):
     alt_travel_df.to_csv("alt_travel_df.csv") #we have created a data frame with only the origin and destination colums from the travel file
     short_air_df = new_modified_aircodes_file_df[["local_code", "iata_code", "coordinates"]].copy().reset_index() #short_air_df is a truncated version of modified_air_codes.csv only containing relevant columsn
     short_air_df.to_csv("short_air_df.csv")
-    flight_distance = calculate_flight_distance(alt_travel_df, short_air_df)
-
-    #short haul: <300 miles 0.206kg CO2
-    #Med haul: between 300 and 2300 miles 0.131kg CO2
-    #long haul: >2300 miles 0.161 CO2
-    kg_co2 = 0
-    tons_co2 = 0
-    for i in range(len(flight_distance)):
-        if flight_distance[i] < 300:
-            kg_co2 = kg_co2 + (flight_distance[i]*0.2081145)
-        elif (flight_distance[i] >= 300) and (flight_distance[i] <2300):
-            kg_co2 = kg_co2 + (flight_distance[i]*0.1322666)
-        elif flight_distance[i] > 2300:
-            kg_co2 = kg_co2 + (flight_distance[i]*0.1625348)
-
-    print(f"total Bates CO2 is {kg_co2}kg")
-
-def main():
-    travel_df = read_travel_file()
-    modified_aircodes_file_df = pd.read_csv("modified_air_codes.csv", index_col = 0)
-    air_codes_df = pd.read_csv("airport_codes.csv")
-    new_modified_aircodes_file_df = update_modified_aircodes_file(travel_df, modified_aircodes_file_df, air_codes_df)
-    total_emissions = calculate_emissions(travel_df, new_modified_aircodes_file_df)
-    print(total_emissions)
-
-main()
+    flight_distance = calculate_flight_distance(alt_travel_df, short_air_df, distance_model)
+
+    segments_df = classify_emissions(flight_distance, bands)
+    segments_df = pd.concat([travel_df.reset_index(drop = True), segments_df], axis = 1)
+    summary_df = summarize_emissions(segments_df)
+
+    logger.info(f"total Bates CO2 is {summary_df['kg_co2'].sum()}kg")
+    return segments_df, summary_df
+
+def count_travel_file(name: str, rollups: dict = None, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> object:
+
+    '''
+        Streams a travel file once and counts its flights by route and by the columns the rollups group by (see
+        travel_reader.count_travel_routes). The result is all that is needed both to update modified_air_codes.csv and to
+        calculate the emissions, so the travel file is only ever read once per run.
+
+        Inputs:
+            str -- name: the travel file (.xlsx, .csv or .parquet)
+            dict -- rollups: rollup name -> the travel file columns it groups by (see travel_rollups.ROLLUPS)
+            int -- chunk_rows: the number of travel file rows read at once
+
+        Returns:
+            A data frame with the Origination, Destination and rollup columns and the number of flights of each combination
+    '''
+
+    if rollups is None:
+        rollups = {}
+    columns = list(dict.fromkeys(list(TRAVEL_COLUMNS) + rollup_source_columns(rollups)))
+    prepare = partial(prepare_rollup_columns, rollups = rollups) if len(rollups) != 0 else None
+    return count_travel_routes(name, columns, chunk_rows, prepare)
+
+def calculate_route_emissions(route_counts_df: object, new_modified_aircodes_file_df: object, bands: object = EMISSION_BANDS,
+route_cache: object = None, recorder: object = None, rollups: dict = None, distance_model: object = HAVERSINE,
+code_aliases: dict = None) -> tuple:
+
+    '''
+        Calculates emissions from the route counts of a travel file. Every row of route_counts_df goes through the distance and
+        emissions calculations once and its results are weighted by its number of flights, so the work depends on the number of
+        distinct routes rather than on the number of flights.
+
+        Inputs:
+            obj -- route_counts_df: the data frame returned by count_travel_file
+            obj -- new_modified_aircodes_file_df: the updated modified_air_codes.csv data frame
+            obj -- bands: the table of haul bands and emissions factors, emissions.EMISSION_BANDS by default
+            obj -- route_cache: an optional route_cache.RouteDistanceCache so that routes seen in earlier runs skip the distance calculation
+            obj -- recorder: an optional instrumentation.RunRecorder; distances, emissions and rollups are recorded as separate stages
+            dict -- rollups: rollup name -> the travel file columns it groups by; route_counts_df must have been counted with the same rollups
+            obj -- distance_model: the flight_distance.DistanceModel used; route_cache must hold distances from the same model
+            dict -- code_aliases: travel file codes mapped to the ident of the airport to use, e.g. from airport_fallback.collect_code_aliases
+
+        Returns:
+            A tuple (summary_df, flight_count, rollup_dfs) with the totals for each band, the number of flights counted, and a
+            dictionary of rollup name -> totals, which is empty when no rollups are requested
+    '''
+
+    if recorder is None:
+        recorder = RunRecorder("calculate_route_emissions")
+    if rollups is None:
+        rollups = {}
+
+    short_air_df = new_modified_aircodes_file_df[["ident", "local_code", "iata_code", "coordinates"]].copy().reset_index()
+    coordinate_lookup = build_coordinate_lookup(short_air_df, code_aliases)
+    flight_counts = route_counts_df[COUNT_COLUMN].to_numpy()
+    with recorder.stage("calculate_flight_distance", rows = len(route_counts_df)):
+        flight_distance = distances_from_lookup(route_counts_df["Origination"].to_numpy(), route_counts_df["Destination"].to_numpy(),
+        coordinate_lookup, route_cache, distance_model)
+    with recorder.stage("calculate_emissions", rows = len(route_counts_df)):
+        segments_df = classify_emissions(flight_distance, bands)
+        summary_df = summarize_emissions(segments_df, flight_counts)
+
+    rollup_dfs = {}
+    if len(rollups) != 0:
+        with recorder.stage("aggregate_rollups", rows = len(route_counts_df)):
+            segments_df = pd.concat([route_counts_df.drop(columns = [COUNT_COLUMN]).reset_index(drop = True), segments_df], axis = 1)
+            rollup_keys = list(dict.fromkeys(column for columns in rollups.values() for column in columns))
+            rollup_dfs = combine_rollups(aggregate_segments(segments_df, rollup_keys, flight_counts), rollups)
+
+    return summary_df, int(flight_counts.sum()), rollup_dfs
+
+def calculate_streamed_emissions(name: str, new_modified_aircodes_file_df: object, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+bands: object = EMISSION_BANDS, route_cache: object = None, recorder: object = None, rollups: dict = None,
+distance_model: object = HAVERSINE, code_aliases: dict = None) -> tuple:
+
+    '''
+        Calculates emissions for a travel file too large to load at once. The file is streamed chunk_rows rows at a time and
+        reduced to the number of flights on every route (count_travel_file), which is then passed to calculate_route_emissions,
+        so that memory use grows with the number of distinct routes rather than with the size of the travel file.
+
+        Inputs:
+            str -- name: the travel file (.xlsx, .csv or .parquet)
+            obj -- new_modified_aircodes_file_df: the updated modified_air_codes.csv data frame
+            int -- chunk_rows: the number of travel file rows read at once
+            obj -- bands: the table of haul bands and emissions factors, emissions.EMISSION_BANDS by default
+            obj -- route_cache: an optional route_cache.RouteDistanceCache so that repeated routes skip the distance calculation
+            obj -- recorder: an optional instrumentation.RunRecorder; reading, distances and emissions are recorded as separate stages
+            dict -- rollups: rollup name -> the travel file columns it groups by (see travel_rollups.ROLLUPS); the columns are read
+            along with Origination and Destination and the flights are counted by all of them
+            obj -- distance_model: the flight_distance.DistanceModel used; route_cache must hold distances from the same model
+            dict -- code_aliases: travel file codes mapped to the ident of the airport to use, e.g. from airport_fallback.collect_code_aliases
+
+        Returns:
+            A tuple (summary_df, flight_count, rollup_dfs) with the totals for each band, the number of flights read, and a
+            dictionary of rollup name -> totals, which is empty when no rollups are requested
+    '''
+
+    if recorder is None:
+        recorder = RunRecorder("calculate_streamed_emissions")
+    with recorder.stage("count_travel_file") as stage:
+        route_counts_df = count_travel_file(name, rollups, chunk_rows)
+        stage["rows"] = len(route_counts_df)
+    return calculate_route_emissions(route_counts_df, new_modified_aircodes_file_df, bands, route_cache, recorder, rollups,
+    distance_model, code_aliases)
+
+def load_inputs(name: str, modified_codes_file: str = "modified_air_codes.csv", airport_codes_file: str = "airport_codes.csv",
+recorder: object = None, rollups: dict = None) -> tuple:
+
+    '''
+        Loads every input of a run concurrently in a thread pool: the route counts of the travel file, modified_air_codes.csv,
+        and airport_codes.csv followed by the airport index, which share the airport store and so are loaded on one thread.
+        Parsing the travel workbook usually takes longest, so the airport table and index are ready by the time it finishes and
+        loading takes about as long as the slowest single input rather than the sum of all of them. An exception raised by any loader is raised here. When the recorder is in deep mode the inputs are loaded
+        one after another on the calling thread instead, as cProfile and tracemalloc can only attribute work done there to its stage.
+
+        Inputs:
+            str -- name: the travel file (.xlsx, .csv or .parquet)
+            str -- modified_codes_file: the modified_air_codes.csv file
+            str -- airport_codes_file: the full airport codes file
+            obj -- recorder: an optional instrumentation.RunRecorder; each loader is recorded as its own stage
+            dict -- rollups: rollup name -> the travel file columns it groups by; the flights are also counted by these columns
+
+        Returns:
+            A tuple (route_counts_df, modified_aircodes_file_df, air_codes_df, airport_index), with route_counts_df as returned by
+            count_travel_file
+    '''
+
+    if recorder is None:
+        recorder = RunRecorder("load_inputs")
+
+    def run_stages(stages):
+        results = []
+        for stage_name, loader in stages:
+            with recorder.stage(stage_name) as stage:
+                results.append(loader())
+                stage["rows"] = len(results[-1])
+        return results
+
+    tasks = [
+        [("count_travel_file", partial(count_travel_file, name, rollups))], #the only pass over the travel file; the route counts are
+        #all that is needed to update modified_air_codes.csv and to calculate the emissions
+        [("read_modified_air_codes", partial(pd.read_csv, modified_codes_file, index_col = 0))],
+        [("read_airport_codes", partial(load_airport_codes, airport_codes_file)), #converts the airport store if it is missing or out
+        #of date, so the index, loaded after it on the same thread, reads the fresh store rather than converting it a second time
+         ("load_airport_index", partial(load_airport_index, airport_codes_file))],
+    ]
+    if recorder.deep:
+        return tuple(result for task in tasks for result in run_stages(task))
+    with ThreadPoolExecutor(max_workers = len(tasks)) as executor:
+        futures = [executor.submit(run_stages, task) for task in tasks]
+        return tuple(result for future in futures for result in future.result())
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description="Update modified_air_codes.csv and calculate flight emissions for a travel file.")
+    parser.add_argument("travel_file", nargs="?", default=None, help="the travel file; asked for if not given")
+    parser.add_argument("--log-level", default="INFO", help="DEBUG, INFO or WARNING")
+    parser.add_argument("--report", default="run_report.json", help="JSON file for the stage timings and memory of this run")
+    parser.add_argument("--deep", action="store_true", help="also capture cProfile statistics and tracemalloc allocation sites")
+    parser.add_argument("--rollups", nargs="+", default=[], choices=list(ROLLUPS), help="also total emissions by these groupings")
+    parser.add_argument("--rollup-dir", default=".", help="directory for the rollup_<name>.csv files")
+    parser.add_argument("--distance-model", default="haversine", choices=DISTANCE_MODELS, help="spherical haversine or ellipsoidal vincenty")
+    parser.add_argument("--uplift", type=float, default=0.0, help="GCD uplift added to every distance, e.g. 0.08 for 8%%")
+    parser.add_argument("--no-fallback", action="store_true", help="leave out airports not in airport_codes.csv instead of looking for a "
+    "close match (fallbacks already in airport_fallbacks.csv are still used)")
+    parser.add_argument("--strict", action="store_true", help="stop with a list of every airport code matching several airports "
+    "instead of picking one; add the right airport for each to airport_overrides.csv")
+    options = parser.parse_args(args)
+    configure_logging(options.log_level)
+    distance_model = DistanceModel(options.distance_model, options.uplift)
+
+    name = options.travel_file
+    if name is None:
+        name = input("Please enter the full name of the travel file and extension (.xlsx, .csv or .parquet) ")
+    recorder = RunRecorder("Update_Travel_File_and_Calculate_Emissions", deep = options.deep)
+
+    rollups = {rollup: ROLLUPS[rollup] for rollup in options.rollups}
+    with recorder.stage("load_inputs"): #the wall time of the concurrent loads; each loader is also recorded separately
+        route_counts_df, modified_aircodes_file_df, air_codes_df, airport_index = load_inputs(name, recorder = recorder, rollups = rollups)
+    with recorder.stage("update_modified_aircodes_file") as stage:
+        resolver = AirportResolver(air_codes_df, strict = options.strict)
+        fallback = None if options.no_fallback else AirportFallback(air_codes_df)
+        code_aliases = collect_code_aliases(DEFAULT_FALLBACK_FILE, resolver.overrides)
+        try:
+            new_modified_aircodes_file_df = append_modified_aircodes_file(route_counts_df, modified_aircodes_file_df, air_codes_df, airport_index,
+            resolver, fallback = fallback, code_aliases = code_aliases)
+        except AmbiguousAirportError as error:
+            logger.error(f"{error}:\n{error.report.to_string()}")
+            raise SystemExit(1)
+        stage["rows"] = len(new_modified_aircodes_file_df) - len(modified_aircodes_file_df)
+
+    route_cache = RouteDistanceCache(filename = route_cache_file(distance_model.name, DEFAULT_CACHE_FILE)) #distances of routes seen in earlier runs are reused
+    if fallback is not None and len(fallback.matches) != 0:
+        logger.warning(f"airports found by the fallback:\n{fallback.report()}")
+        save_fallbacks(fallback.report(), DEFAULT_FALLBACK_FILE)
+        code_aliases = collect_code_aliases(DEFAULT_FALLBACK_FILE, resolver.overrides, fallback)
+
+    summary_df, flight_count, rollup_dfs = calculate_route_emissions(route_counts_df, new_modified_aircodes_file_df, route_cache = route_cache,
+    recorder = recorder, rollups = rollups, distance_model = distance_model, code_aliases = code_aliases) #the travel file is not read again
+    with recorder.stage("save_route_cache"):
+        route_cache.save()
+    logger.info(f"route distance cache: {route_cache.stats()}")
+
+    logger.info(f"emissions by band:\n{summary_df}")
+    logger.info(f"total Bates CO2 for {flight_count} flights is {summary_df['kg_co2'].sum()}kg ({summary_df['tonnes_co2'].sum()} metric tons)")
+    unresolved_count = flight_count - summary_df['flights'].sum()
+    if unresolved_count > 0:
+        logger.warning(f"{unresolved_count} flights were left out because their origin or destination could not be found")
+    if len(rollup_dfs) != 0:
+        logger.info(f"rollups written to {write_rollups(rollup_dfs, options.rollup_dir)}")
+    recorder.write_report(options.report)
+
+if __name__ == "__main__":
+    main()
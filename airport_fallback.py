@@ -0,0 +1,352 @@
+'''
+Fallback resolution for airport codes that are not in airport_codes.csv.
+
+A code from the travel file that matches no iata_code or local_code used to end up in the removal list, and every flight
+to or from it was left out of the totals. The AirportFallback tries, in order:
+
+    1. normalized:  the code with case, spaces and punctuation removed, also matched against gps_code and ident
+                    (e.g. " bos", "KBOS");
+    2. code_edit:   a major airport whose IATA code is one edit away (a swapped, replaced, missing or extra character),
+                    only when a second signal agrees: the city given as a hint is the airport's municipality or has an
+                    airport within CONFIRM_DISTANCE_MILES of it, or the coordinates given are that close to it. A one-edit
+                    code alone is as likely to be a different airport as a typo, so without a hint the candidate is logged
+                    for review (it can be added to airport_overrides.csv) and the code is left unresolved;
+    3. name:        a major airport whose name or municipality contains the text, found through a trigram index (for
+                    entries like "Boston" in the code column, or a city given as a hint);
+    4. nearest:     the major airport nearest to a known city or to given coordinates, found through a KD-tree.
+
+The city and coordinate hints are optional arguments of AirportFallback.resolve for callers that know them. Travel files
+have no city or coordinate columns, so the scripts (Update_Travel_File_and_Calculate_Emissions.py, batch_emissions.py and
+flight_pipeline.py) pass the code alone: for them only normalized and name matches are made, and one-edit candidates are
+always left for review.
+
+Major airports are large and medium airports with an IATA code. Every fallback used is recorded and can be listed with
+report(). save_fallbacks keeps the confident ones (normalized codes and confirmed code edits, see SAVED_METHODS) in
+airport_fallbacks.csv, which maps each fallback code to the ident of the airport chosen so that later runs, and the
+distance calculation, use the same airport; name and nearest matches are only used for the run that found them and are
+looked up again on the next run. The indexes are built the first time they are needed;
+after that each lookup takes well under a millisecond. scipy is used for the KD-tree when it is installed, otherwise the
+nearest airport is found with a vectorized Numpy search.
+
+The module contains the FallbackMatch tuple, the AirportFallback class and the functions load_fallbacks, save_fallbacks
+and collect_code_aliases, the details of which are provided below.
+
+'''
+
+import logging
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from airport_resolver import AIRPORT_TYPE_RANK, MAJOR_AIRPORT_TYPES
+from flight_distance import haversine_miles, parse_coordinates
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+DEFAULT_FALLBACK_FILE = "airport_fallbacks.csv"
+FALLBACK_COLUMNS = ["code", "ident", "method", "score", "name", "municipality", "iata_code"]
+CODE_COLUMNS = ("iata_code", "local_code", "gps_code", "ident")
+CODE_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+NAME_STOPWORDS = {"AIRPORT", "INTERNATIONAL", "INTL", "REGIONAL", "MUNICIPAL", "FIELD", "AIRFIELD", "AIR", "BASE", "THE", "OF"}
+DEFAULT_MIN_NAME_SCORE = 0.8
+CONFIRM_DISTANCE_MILES = 100 #a city or point hint this close to a one-edit code's airport confirms it
+SAVED_METHODS = ("normalized", "code_edit+city", "code_edit+coordinates") #matches kept in airport_fallbacks.csv
+
+FallbackMatch = namedtuple("FallbackMatch", ["code", "row", "ident", "method", "score"])
+FallbackMatch.__doc__ = '''An airport chosen by the fallback: the code looked up, the airport_codes.csv row and ident chosen, the method used and a score from 0 to 1'''
+
+
+def _normalize(text: object) -> str:
+    if not isinstance(text, str):
+        return ""
+    return re.sub(r"[^A-Z0-9]", "", text.upper())
+
+
+def _normalize_column(values: object) -> object:
+    return pd.Series(values, dtype=object).fillna("").astype(str).str.upper().str.replace(r"[^A-Z0-9]", "", regex=True).to_numpy()
+
+
+def _trigrams(text: object) -> set:
+    if not isinstance(text, str):
+        return set()
+    tokens = [token for token in re.split(r"[^A-Z0-9]+", text.upper()) if token != "" and token not in NAME_STOPWORDS]
+    trigrams = set()
+    for token in tokens:
+        padded = f" {token} " #padding lets the start and end of every word count
+        trigrams.update(padded[position:position + 3] for position in range(len(padded) - 2))
+    return trigrams
+
+
+def _unit_vectors(lattitude: object, longitude: object) -> object:
+    lattitude = np.radians(lattitude)
+    longitude = np.radians(longitude)
+    return np.column_stack([np.cos(lattitude) * np.cos(longitude), np.cos(lattitude) * np.sin(longitude), np.sin(lattitude)])
+
+
+def _one_edit_variants(code: str) -> list:
+    '''
+    Returns (variant, kind) pairs for every code one edit away from code, most likely edits first: kind 0 for two swapped
+    neighbouring characters, 1 for a replaced character, 2 for a missing or extra character.
+    '''
+    variants = []
+    for position in range(len(code) - 1):
+        variants.append((code[:position] + code[position + 1] + code[position] + code[position + 2:], 0))
+    for position in range(len(code)):
+        variants.extend((code[:position] + char + code[position + 1:], 1) for char in CODE_ALPHABET if char != code[position])
+    for position in range(len(code)):
+        variants.append((code[:position] + code[position + 1:], 2))
+    for position in range(len(code) + 1):
+        variants.extend((code[:position] + char + code[position:], 2) for char in CODE_ALPHABET)
+    return variants
+
+
+logger = logging.getLogger(__name__)
+
+
+class AirportFallback:
+    '''
+    Finds the most likely airport for a code that is not in airport_codes.csv.
+
+    Inputs:
+        obj -- air_codes_df: the data frame containing information from airport_codes.csv
+        float -- min_name_score: the share of the text's trigrams a name or municipality must contain to match
+    '''
+
+    def __init__(self, air_codes_df: object, min_name_score: float = DEFAULT_MIN_NAME_SCORE):
+        self.air_codes_df = air_codes_df
+        self.min_name_score = min_name_score
+        self.matches = [] #every FallbackMatch returned, in the order the codes were looked up
+        self.unconfirmed = [] #code_edit candidates that no hint confirmed, left unresolved for review
+        self._built = False
+
+    def _build(self):
+        air_codes_df = self.air_codes_df
+        rows = air_codes_df.index.to_numpy()
+        types = air_codes_df["type"].astype(object).to_numpy()
+        has_iata = pd.notna(air_codes_df["iata_code"]).to_numpy()
+        is_major = pd.Series(types).isin(MAJOR_AIRPORT_TYPES).to_numpy() & has_iata
+        type_rank = pd.Series(types).map(AIRPORT_TYPE_RANK).fillna(len(AIRPORT_TYPE_RANK)).to_numpy()
+        self._rank = np.empty(len(rows), dtype=np.int64) #position of each row in the AirportResolver ranking: majors first
+        self._rank[np.lexsort((np.arange(len(rows)), type_rank, ~has_iata, ~is_major))] = np.arange(len(rows))
+
+        if "lattitude" in air_codes_df.columns and "longitude" in air_codes_df.columns:
+            lattitude = air_codes_df["lattitude"].to_numpy(dtype=float)
+            longitude = air_codes_df["longitude"].to_numpy(dtype=float)
+        else:
+            lattitude, longitude = parse_coordinates(air_codes_df["coordinates"])
+
+        code_frames = []
+        for column in CODE_COLUMNS:
+            code_frames.append(pd.DataFrame({"code": _normalize_column(air_codes_df[column].to_numpy()), "position": np.arange(len(rows))}))
+        code_df = pd.concat(code_frames)
+        code_df = code_df[code_df["code"] != ""]
+        code_df = code_df.iloc[np.argsort(self._rank[code_df["position"].to_numpy()], kind="stable")].drop_duplicates("code")
+        self._code_positions = dict(zip(code_df["code"], code_df["position"])) #normalized code -> best ranked row position
+
+        major_positions = np.flatnonzero(is_major & ~np.isnan(lattitude) & ~np.isnan(longitude))
+        major_positions = major_positions[np.argsort(self._rank[major_positions], kind="stable")] #best ranked first
+        self._major_positions = major_positions
+        self._major_codes = {}
+        for position, code in zip(major_positions, air_codes_df["iata_code"].astype(object).to_numpy()[major_positions]):
+            self._major_codes.setdefault(_normalize(code), position)
+
+        postings = {}
+        names = air_codes_df["name"].astype(object).to_numpy()
+        municipalities = air_codes_df["municipality"].astype(object).to_numpy()
+        for major, position in enumerate(major_positions):
+            trigrams = _trigrams(names[position]) | _trigrams(municipalities[position])
+            for trigram in trigrams:
+                postings.setdefault(trigram, []).append(major)
+        self._postings = {trigram: np.array(majors, dtype=np.int64) for trigram, majors in postings.items()}
+
+        city_df = pd.DataFrame({"city": _normalize_column(municipalities), "position": np.arange(len(rows))})
+        city_df = city_df[(city_df["city"] != "") & ~np.isnan(lattitude)]
+        city_df = city_df.iloc[np.argsort(self._rank[city_df["position"].to_numpy()], kind="stable")].drop_duplicates("city")
+        self._city_positions = dict(zip(city_df["city"], city_df["position"])) #normalized municipality -> best ranked airport there
+
+        self._lattitude = lattitude
+        self._longitude = longitude
+        self._major_vectors = _unit_vectors(lattitude[major_positions], longitude[major_positions])
+        self._tree = cKDTree(self._major_vectors) if cKDTree is not None and len(major_positions) != 0 else None
+        self._built = True
+
+    def _match(self, code: str, position: int, method: str, score: float) -> FallbackMatch:
+        match = FallbackMatch(code, self.air_codes_df.index[position], self.air_codes_df["ident"].iat[position], method, float(score))
+        self.matches.append(match)
+        return match
+
+    def _match_code_edit(self, normalized: str) -> tuple:
+        best = None
+        for variant, kind in _one_edit_variants(normalized):
+            position = self._major_codes.get(variant)
+            if position is not None and (best is None or (kind, self._rank[position]) < (best[1], self._rank[best[0]])):
+                best = (position, kind)
+        return best
+
+    def _confirm_code_edit(self, position: int, city: str = None, coordinates: tuple = None) -> str:
+        '''
+        Returns:
+            "city" or "coordinates" for the hint that places the airport at position, or None if no hint agrees
+        '''
+        def near(lattitude: float, longitude: float) -> bool:
+            distance = haversine_miles(np.array([lattitude]), np.array([longitude]), self._lattitude[position:position + 1],
+            self._longitude[position:position + 1])[0]
+            return distance <= CONFIRM_DISTANCE_MILES
+
+        city = _normalize(city)
+        if city != "":
+            if city == _normalize(self.air_codes_df["municipality"].iat[position]):
+                return "city"
+            if city in self._city_positions and near(self._lattitude[self._city_positions[city]], self._longitude[self._city_positions[city]]):
+                return "city"
+        if coordinates is not None and near(*coordinates):
+            return "coordinates"
+        return None
+
+    def _match_name(self, text: str) -> tuple:
+        query = _trigrams(text)
+        posting_lists = [self._postings[trigram] for trigram in query if trigram in self._postings]
+        if len(query) == 0 or len(posting_lists) == 0:
+            return None
+        hits = np.bincount(np.concatenate(posting_lists), minlength=len(self._major_positions))
+        best = int(np.argmax(hits)) #major airports are stored best ranked first, so ties go to the larger airport
+        score = hits[best] / len(query)
+        if score < self.min_name_score:
+            return None
+        return self._major_positions[best], score
+
+    def nearest_major(self, lattitude: float, longitude: float) -> int:
+        '''
+        Finds the major airport nearest to a point.
+
+        Inputs:
+            float -- lattitude, longitude: the point in degrees
+
+        Returns:
+            The row position in air_codes_df of the nearest major airport, or None if there are no major airports
+        '''
+        if not self._built:
+            self._build()
+        if len(self._major_positions) == 0:
+            return None
+        point = _unit_vectors(np.array([lattitude]), np.array([longitude]))[0] #chord distance orders points like great-circle distance
+        if self._tree is not None:
+            nearest = self._tree.query(point)[1]
+        else:
+            nearest = np.argmin(((self._major_vectors - point)**2).sum(axis=1))
+        return self._major_positions[nearest]
+
+    def resolve(self, code: str, city: str = None, coordinates: tuple = None) -> FallbackMatch:
+        '''
+        Finds the most likely airport for a code that is not in airport_codes.csv.
+
+        Inputs:
+            str -- code: the code from the travel file
+            str -- city: an optional city name known for the flight
+            tuple -- coordinates: an optional (lattitude, longitude) known for the flight
+
+        Returns:
+            A FallbackMatch, or None if no airport could be found
+        '''
+        if not self._built:
+            self._build()
+        normalized = _normalize(code)
+
+        if normalized != "" and normalized in self._code_positions:
+            return self._match(code, self._code_positions[normalized], "normalized", 1.0)
+        if 3 <= len(normalized) <= 4:
+            edit = self._match_code_edit(normalized)
+            if edit is not None:
+                signal = self._confirm_code_edit(edit[0], city, coordinates)
+                if signal is not None:
+                    return self._match(code, edit[0], f"code_edit+{signal}", 1 - 1 / len(normalized))
+                candidate = FallbackMatch(code, self.air_codes_df.index[edit[0]], self.air_codes_df["ident"].iat[edit[0]], "code_edit", 0.0)
+                self.unconfirmed.append(candidate)
+                logger.warning(f"{code} is one edit away from {self.air_codes_df['iata_code'].iat[edit[0]]} ({candidate.ident}) but no city "
+                "or coordinates confirm it; add it to airport_overrides.csv if it is the right airport")
+        for text in (code, city):
+            if isinstance(text, str) and len(_normalize(text)) > 3: #three letters are too short to mean a name
+                name_match = self._match_name(text)
+                if name_match is not None:
+                    return self._match(code, name_match[0], "name", name_match[1])
+        if _normalize(city) in self._city_positions:
+            position = self._city_positions[_normalize(city)]
+            coordinates = (self._lattitude[position], self._longitude[position])
+        if coordinates is not None:
+            position = self.nearest_major(*coordinates)
+            if position is not None:
+                return self._match(code, position, "nearest", 0.0)
+        return None
+
+    def report(self) -> object:
+        '''
+        Lists every fallback used.
+
+        Returns:
+            A data frame with the columns code, ident, method, score, name, municipality and iata_code
+        '''
+        if len(self.matches) == 0:
+            return pd.DataFrame(columns=FALLBACK_COLUMNS)
+        report_df = pd.DataFrame(self.matches, columns=FallbackMatch._fields)
+        airports_df = self.air_codes_df.loc[report_df["row"], ["name", "municipality", "iata_code"]].astype(object)
+        report_df = pd.concat([report_df.reset_index(drop=True), airports_df.reset_index(drop=True)], axis=1)
+        return report_df[FALLBACK_COLUMNS]
+
+
+def load_fallbacks(filename: str = DEFAULT_FALLBACK_FILE) -> dict:
+    '''
+    Reads the fallback file. Rows with a method outside SAVED_METHODS, such as unconfirmed code edits saved by older
+    versions, are ignored so that those codes are looked up again.
+
+    Inputs:
+        str -- filename: the csv file written by save_fallbacks
+
+    Returns:
+        A dictionary mapping each fallback code to the ident of its airport; empty if the file does not exist
+    '''
+    if not os.path.exists(filename):
+        return {}
+    fallbacks_df = pd.read_csv(filename, dtype={"code": str, "ident": str}, keep_default_na=False)
+    fallbacks_df = fallbacks_df[fallbacks_df["method"].isin(SAVED_METHODS)]
+    return dict(zip(fallbacks_df["code"], fallbacks_df["ident"]))
+
+
+def save_fallbacks(report_df: object, filename: str = DEFAULT_FALLBACK_FILE):
+    '''
+    Adds the confident fallbacks of a run (those with a method in SAVED_METHODS) to the fallback file and drops any other
+    rows already in it. A code already in the file keeps its newest airport, and the file is sorted by code so that it
+    diffs cleanly.
+
+    Inputs:
+        obj -- report_df: the data frame returned by AirportFallback.report
+        str -- filename: the csv file to update
+    '''
+    if os.path.exists(filename):
+        report_df = pd.concat([pd.read_csv(filename, dtype={"code": str, "ident": str}, keep_default_na=False), report_df])
+    report_df = report_df[report_df["method"].isin(SAVED_METHODS)].drop_duplicates("code", keep="last").sort_values("code")
+    report_df[FALLBACK_COLUMNS].to_csv(filename, index=False)
+
+
+def collect_code_aliases(filename: str = DEFAULT_FALLBACK_FILE, overrides: dict = None, fallback: AirportFallback = None) -> dict:
+    '''
+    Collects the code aliases passed to flight_distance.build_coordinate_lookup: the fallbacks saved in the fallback file,
+    then the matches of this run's fallback (including those save_fallbacks does not keep), then the overrides of
+    airport_resolver, each taking precedence over the ones before. An override may point a code at an airport that does
+    not carry it, so the overrides are needed by the distance stage as well as by the resolver.
+
+    Inputs:
+        str -- filename: the fallback file
+        dict -- overrides: code -> ident, e.g. AirportResolver.overrides
+        obj -- fallback: the AirportFallback of this run, if any
+
+    Returns:
+        A dictionary mapping codes to the ident of the airport to use
+    '''
+    matches = {} if fallback is None else {match.code: match.ident for match in fallback.matches}
+    return {**load_fallbacks(filename), **matches, **(overrides or {})}
@@ -0,0 +1,181 @@
+'''
+Prebuilt airport code index used by Create_Truncated_Codes_File_FINAL.py and Update_Travel_File_and_Calculate_Emissions.py.
+
+Rather than filtering the full airport_codes.csv data frame with a boolean mask for every airport, an index is built once
+that maps every iata_code and local_code, normalized with route_cache.normalize_code as the distance stage normalizes them,
+to the row(s) of airport_codes.csv it appears on, along with the parsed lattitude and longitude of every row. The index is
+saved next to airport_codes.csv as a small directory of .npy files which are memory-mapped when loaded, and it is only
+rebuilt when the modification time and the contents of airport_codes.csv change. Every file is written to a temporary file
+and then moved into place, as the airport store is, so a reader never sees a partially written file.
+
+The module contains the AirportIndex class and the functions build_airport_index, save_airport_index and
+load_airport_index, the details of which are provided below.
+
+'''
+
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from airport_store import COORDINATE_COLUMNS, file_sha256, load_airport_codes
+from flight_distance import parse_coordinates
+from route_cache import normalize_code
+
+INDEX_VERSION = 2 #version 2 normalizes the codes
+INDEX_SUFFIX = ".index" #the index for "airport_codes.csv" is stored in the directory "airport_codes.csv.index"
+INDEX_ARRAYS = ("codes", "rows", "lattitude", "longitude")
+INDEX_SOURCE_COLUMNS = ["iata_code", "local_code"] + COORDINATE_COLUMNS #the only columns of the airport store the index is built from
+
+
+class AirportIndex:
+    '''
+    Hash index from airport code to the rows of airport_codes.csv where the code appears as an iata_code or local_code.
+
+    Attributes:
+        codes -- Numpy array of normalized codes, one entry per (code, row) pair
+        rows -- Numpy integer array of the airport_codes.csv row for each entry in codes
+        lattitude, longitude -- Numpy float arrays with the coordinates of every row of airport_codes.csv
+    '''
+
+    def __init__(self, codes: object, rows: object, lattitude: object, longitude: object):
+        self.codes = codes
+        self.rows = rows
+        self.lattitude = lattitude
+        self.longitude = longitude
+        self._code_to_rows = None #the dictionary is only built on first lookup so that loading stays cheap
+
+    def _build_lookup(self) -> dict:
+        code_to_rows = {}
+        for code, row in zip(self.codes.tolist(), self.rows.tolist()):
+            code_rows = code_to_rows.setdefault(code, [])
+            if row not in code_rows: #a row whose iata_code and local_code are the same code is only listed once
+                code_rows.append(row)
+        return code_to_rows
+
+    def lookup(self, code: str) -> list:
+        '''
+        Finds every row of airport_codes.csv where the code is the iata_code or the local_code. Codes are compared after
+        route_cache.normalize_code, so " bos" finds the rows of BOS.
+
+        Inputs:
+            str -- code: an airport code from the travel file
+
+        Returns:
+            A list of row indexes in ascending order; empty when the code is not in airport_codes.csv
+        '''
+        if self._code_to_rows is None:
+            self._code_to_rows = self._build_lookup()
+        return list(self._code_to_rows.get(normalize_code(code), []))
+
+    def __contains__(self, code: str) -> bool:
+        return len(self.lookup(code)) > 0
+
+    def __len__(self) -> int:
+        return len(self.lattitude)
+
+
+def build_airport_index(air_codes_df: object) -> AirportIndex:
+    '''
+    Builds the index in memory from the airport_codes.csv data frame.
+
+    Inputs:
+        obj -- air_codes_df: the data frame containing information from airport_codes.csv; the parsed "lattitude" and
+        "longitude" columns of the airport store are used when present, otherwise the "coordinates" column is parsed
+
+    Returns:
+        An AirportIndex object
+    '''
+    positions = np.arange(len(air_codes_df), dtype=np.int64)
+    code_frames = []
+    for column in ("iata_code", "local_code"):
+        column_codes = air_codes_df[column].to_numpy()
+        has_code = pd.notna(column_codes)
+        codes = [normalize_code(str(code)) for code in column_codes[has_code]]
+        code_frames.append(pd.DataFrame({"code": codes, "row": positions[has_code]}))
+    code_df = pd.concat(code_frames).dropna(subset=["code"]) #blank codes normalize to None
+    code_df = code_df.sort_values("row", kind="stable") #rows are kept in ascending order for each code
+
+    if all(column in air_codes_df.columns for column in COORDINATE_COLUMNS):
+        lattitude = air_codes_df["lattitude"].to_numpy(dtype=float)
+        longitude = air_codes_df["longitude"].to_numpy(dtype=float)
+    else:
+        lattitude, longitude = parse_coordinates(air_codes_df["coordinates"])
+    return AirportIndex(code_df["code"].to_numpy(dtype=str), code_df["row"].to_numpy(dtype=np.int64), lattitude, longitude)
+
+
+def _replace_file(path: str, write: object):
+    descriptor, temp_file = tempfile.mkstemp(suffix=os.path.splitext(path)[1], dir=os.path.dirname(path))
+    os.close(descriptor)
+    try:
+        write(temp_file)
+        os.replace(temp_file, path) #readers, including a concurrent build, never see a partially written file
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+
+def _write_meta(index_dir: str, meta: dict):
+    def write(temp_file):
+        with open(temp_file, "w") as file:
+            json.dump(meta, file)
+    _replace_file(os.path.join(index_dir, "meta.json"), write)
+
+
+def save_airport_index(airport_index: AirportIndex, index_dir: str, meta: dict):
+    '''
+    Saves the index as one .npy file per array plus a meta.json file describing the airport_codes.csv it was built from.
+
+    Inputs:
+        obj -- airport_index: the AirportIndex to save
+        str -- index_dir: the directory to save the index in; it is created if it does not exist
+        dict -- meta: information about the source file (mtime, size, sha256) used to decide when to rebuild
+    '''
+    os.makedirs(index_dir, exist_ok=True)
+    for name in INDEX_ARRAYS:
+        _replace_file(os.path.join(index_dir, f"{name}.npy"), lambda temp_file: np.save(temp_file, getattr(airport_index, name)))
+    _write_meta(index_dir, meta) #written last so that a partially written index is never treated as valid
+
+
+def load_airport_index(filename: str = "airport_codes.csv", index_dir: str = None) -> AirportIndex:
+    '''
+    Loads the index for airport_codes.csv, building and saving it first if it does not exist or is out of date.
+    The index is considered up to date if airport_codes.csv has the same modification time and size it had when the index
+    was built, or, if those changed, the same SHA-256 hash.
+
+    Inputs:
+        str -- filename: the name of the airport codes file
+        str -- index_dir: the directory holding the saved index; defaults to the file name followed by ".index"
+
+    Returns:
+        An AirportIndex object whose arrays are memory-mapped from disk
+    '''
+    if index_dir is None:
+        index_dir = filename + INDEX_SUFFIX
+    stat = os.stat(filename)
+    meta = {"version": INDEX_VERSION, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+    saved_meta = None
+    meta_path = os.path.join(index_dir, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path) as file:
+            saved_meta = json.load(file)
+
+    up_to_date = False
+    if saved_meta is not None and saved_meta.get("version") == INDEX_VERSION:
+        if saved_meta.get("mtime_ns") == meta["mtime_ns"] and saved_meta.get("size") == meta["size"]:
+            up_to_date = True
+        else:
+            meta["sha256"] = file_sha256(filename) #the file was touched, only rebuild if its contents actually changed
+            if saved_meta.get("sha256") == meta["sha256"]:
+                _write_meta(index_dir, meta)
+                up_to_date = True
+
+    if not up_to_date:
+        meta.setdefault("sha256", file_sha256(filename))
+        save_airport_index(build_airport_index(load_airport_codes(filename, INDEX_SOURCE_COLUMNS)), index_dir, meta)
+
+    arrays = [np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r") for name in INDEX_ARRAYS]
+    return AirportIndex(*arrays)
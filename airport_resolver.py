@@ -0,0 +1,170 @@
+'''
+Conflict resolution for airport codes that match more than one row of airport_codes.csv.
+
+Some airports share the same iata_code or local_code. Both scripts used to stop and ask the user which row was meant
+with input(), which blocks scheduled jobs. The AirportResolver picks a row without user interaction:
+
+    1. an overrides file (airport_overrides.csv, with the columns "code" and "ident") records the choice for a code;
+    2. otherwise a deterministic ranking prefers large and medium airports, then rows that have an IATA code;
+    3. in strict mode no choice is made and every ambiguous code is collected into one report, raised as an
+       AmbiguousAirportError once all codes have been looked at.
+
+The original behaviour of asking the user is still available with policy = "interactive".
+
+An override may also point a code at an airport that does not carry that code at all. The override is then passed to
+flight_distance.build_coordinate_lookup as a code alias (see AirportResolver.overrides) so that the distance stage finds
+the same airport.
+
+The module contains the AmbiguousAirportError and AirportResolver classes and the function load_overrides, the details of
+which are provided below.
+
+'''
+
+import logging
+import os
+
+import pandas as pd
+
+DEFAULT_OVERRIDES_FILE = "airport_overrides.csv"
+RESOLVER_POLICIES = ("rank", "interactive")
+MAJOR_AIRPORT_TYPES = ("large_airport", "medium_airport")
+AIRPORT_TYPE_RANK = {"large_airport": 0, "medium_airport": 1, "small_airport": 2, "seaplane_base": 3, "heliport": 4,
+"balloonport": 5, "closed": 6} #types not listed here rank after "closed"
+
+logger = logging.getLogger(__name__)
+
+
+class AmbiguousAirportError(Exception):
+    '''
+    Raised in strict mode when one or more airport codes could not be resolved to a single row of airport_codes.csv.
+
+    Attributes:
+        report -- a data frame with one row per candidate airport of every ambiguous code
+    '''
+
+    def __init__(self, report: object):
+        self.report = report
+        codes = list(pd.unique(report["code"]))
+        super().__init__(f"{len(codes)} ambiguous airport codes need an entry in the overrides file: {codes}")
+
+
+def load_overrides(filename: str = DEFAULT_OVERRIDES_FILE) -> dict:
+    '''
+    Reads the overrides file.
+
+    Inputs:
+        str -- filename: a csv file with the columns "code" and "ident"
+
+    Returns:
+        A dict mapping airport code to the chosen ident; empty if the file does not exist
+    '''
+    if not os.path.exists(filename):
+        return {}
+    overrides_df = pd.read_csv(filename, dtype=str)
+    return dict(zip(overrides_df["code"], overrides_df["ident"]))
+
+
+class AirportResolver:
+    '''
+    Chooses a single row of airport_codes.csv for an airport code with several candidate rows.
+
+    Inputs:
+        obj -- air_codes_df: the data frame containing information from airport_codes.csv
+        dict -- overrides: mapping of airport code to the ident to use; read from DEFAULT_OVERRIDES_FILE if not provided
+        str -- policy: "rank" to choose deterministically or "interactive" to ask the user
+        bool -- strict: if True, ambiguous codes without an override are collected instead of resolved
+    '''
+
+    def __init__(self, air_codes_df: object, overrides: dict = None, policy: str = "rank", strict: bool = False):
+        if policy not in RESOLVER_POLICIES:
+            raise ValueError(f"Unknown resolver policy {policy}; expected one of {RESOLVER_POLICIES}")
+        self.air_codes_df = air_codes_df
+        self.overrides = load_overrides() if overrides is None else overrides
+        self.policy = policy
+        self.strict = strict
+        self.ambiguities = [] #(code, candidate rows) pairs left unresolved in strict mode
+        self._ident_rows = None
+
+    def _row_for_ident(self, ident: str, candidate_rows: list) -> int:
+        for row in candidate_rows:
+            if self.air_codes_df.at[row, "ident"] == ident:
+                return row
+        if self._ident_rows is None: #the override may point at an airport that does not carry the code at all
+            self._ident_rows = {value: row for row, value in zip(self.air_codes_df.index, self.air_codes_df["ident"])}
+        if ident not in self._ident_rows:
+            raise ValueError(f"The override ident {ident} does not exist in airport_codes.csv")
+        return self._ident_rows[ident]
+
+    def rank(self, candidate_rows: list) -> list:
+        '''
+        Orders candidate rows from most to least likely: large and medium airports first, then rows with an IATA code,
+        then by airport type, then by row so that ties are always broken the same way.
+
+        Inputs:
+            list -- candidate_rows: indexes of rows in airport_codes.csv
+
+        Returns:
+            The candidate rows in ranked order
+        '''
+        def rank_key(row):
+            airport_type = self.air_codes_df.at[row, "type"]
+            has_iata = pd.notna(self.air_codes_df.at[row, "iata_code"])
+            return (airport_type not in MAJOR_AIRPORT_TYPES, not has_iata, AIRPORT_TYPE_RANK.get(airport_type, len(AIRPORT_TYPE_RANK)), row)
+        return sorted(candidate_rows, key=rank_key)
+
+    def _ask_user(self, code: str, candidate_rows: list) -> int:
+        candidates_df = self.air_codes_df.loc[candidate_rows, ["ident", "type", "name", "municipality", "iata_code", "local_code"]]
+        logger.warning(f"{code} matches several airports in airport_codes.csv:\n{candidates_df}")
+        correct_index = int(input(f'{candidate_rows} These indeces represent rows in "airport_codes" that were identified as corresponding to {code}.\
+        Please review the airport_codes file and input the index of the correct airport '))
+        return correct_index
+
+    def resolve(self, code: str, candidate_rows: list) -> int:
+        '''
+        Picks the row of airport_codes.csv to use for an airport code.
+
+        Inputs:
+            str -- code: the airport code from the travel file
+            list -- candidate_rows: indexes of every row of airport_codes.csv matching the code
+
+        Returns:
+            The chosen row index, or None if there are no candidates or the code is ambiguous in strict mode
+        '''
+        if code in self.overrides:
+            return self._row_for_ident(self.overrides[code], candidate_rows)
+        if len(candidate_rows) == 0:
+            return None
+        if len(candidate_rows) == 1:
+            return candidate_rows[0]
+        if self.strict:
+            self.ambiguities.append((code, list(candidate_rows)))
+            return None
+        if self.policy == "interactive":
+            return self._ask_user(code, candidate_rows)
+        return self.rank(candidate_rows)[0]
+
+    def report(self) -> object:
+        '''
+        Lists every ambiguous code collected in strict mode along with its candidate airports in ranked order.
+
+        Returns:
+            A data frame with the columns code, row, ident, type, name, municipality, iata_code and local_code
+        '''
+        report_columns = ["ident", "type", "name", "municipality", "iata_code", "local_code"]
+        report_frames = []
+        for code, candidate_rows in self.ambiguities:
+            ranked_rows = self.rank(candidate_rows)
+            candidates_df = self.air_codes_df.loc[ranked_rows, report_columns].copy()
+            candidates_df.insert(0, "row", ranked_rows)
+            candidates_df.insert(0, "code", code)
+            report_frames.append(candidates_df)
+        if len(report_frames) == 0:
+            return pd.DataFrame(columns=["code", "row"] + report_columns)
+        return pd.concat(report_frames).reset_index(drop=True)
+
+    def raise_for_ambiguities(self):
+        '''
+        Raises an AmbiguousAirportError with the full report if any ambiguous codes were collected in strict mode.
+        '''
+        if len(self.ambiguities) != 0:
+            raise AmbiguousAirportError(self.report())
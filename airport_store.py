@@ -0,0 +1,159 @@
+'''
+Columnar binary store for airport_codes.csv.
+
+airport_codes.csv is reparsed from text on every run, with every column read as strings and the coordinates kept as
+"longitude, lattitude" text. convert_airport_codes writes the table once as a Parquet file in which
+
+    - the code columns (type, continent, iso_country, iso_region, gps_code, iata_code, local_code) are dictionary-encoded
+      categoricals,
+    - the coordinates are also split into float64 "lattitude" and "longitude" columns,
+
+and load_airport_codes reads back only the columns a caller asks for. Values are parsed exactly as pd.read_csv parses
+airport_codes.csv, so rows copied from the store into modified_air_codes.csv are written the same way as before. The store
+records the modification time, size and SHA-256 hash of the airport_codes.csv it was converted from, and, like the airport
+index, it is rebuilt when the modification time or size changed and the contents did too; a replaced airport_codes.csv
+with an older modification time (a restored backup, cp -p) is therefore still picked up. Parquet support comes from
+pyarrow, which pandas uses for read_parquet/to_parquet.
+
+    python airport_store.py airport_codes.csv
+
+The module contains the functions file_sha256, convert_airport_codes, load_airport_store and load_airport_codes, the details
+of which are provided below.
+
+'''
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from flight_distance import parse_coordinates
+
+CATEGORY_COLUMNS = ['type', 'continent', 'iso_country', 'iso_region', 'gps_code', 'iata_code', 'local_code']
+COORDINATE_COLUMNS = ['lattitude', 'longitude']
+STORE_SUFFIX = ".parquet"
+STORE_VERSION = 1
+SOURCE_METADATA_KEY = b"airport_codes_source" #Parquet key holding the mtime, size and sha256 of the csv file the store was converted from
+
+
+def file_sha256(filename: str) -> str:
+    '''
+    Returns:
+        The SHA-256 hash of the file's contents as a hex string
+    '''
+    digest = hashlib.sha256()
+    with open(filename, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_meta(filename: str, sha256: str = None) -> dict:
+    stat = os.stat(filename)
+    return {"version": STORE_VERSION, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": sha256}
+
+
+def _write_store(table: object, store_file: str, source_meta: dict):
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), SOURCE_METADATA_KEY: json.dumps(source_meta)})
+    descriptor, temp_file = tempfile.mkstemp(suffix=STORE_SUFFIX, dir=os.path.dirname(os.path.abspath(store_file)))
+    os.close(descriptor)
+    try:
+        pq.write_table(table, temp_file) #the row order is kept, so row positions still match airport_codes.csv
+        os.replace(temp_file, store_file) #readers, including a concurrent conversion, never see a partially written store
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+
+def _stored_source_meta(store_file: str) -> dict:
+    if not os.path.exists(store_file):
+        return None
+    metadata = pq.read_schema(store_file).metadata or {}
+    if SOURCE_METADATA_KEY not in metadata:
+        return None
+    return json.loads(metadata[SOURCE_METADATA_KEY])
+
+
+def convert_airport_codes(filename: str = "airport_codes.csv", store_file: str = None) -> str:
+    '''
+    Converts airport_codes.csv to the columnar store.
+
+    Inputs:
+        str -- filename: the airport codes csv file
+        str -- store_file: the Parquet file to write; defaults to the csv file name with a .parquet extension
+
+    Returns:
+        The name of the store file
+    '''
+    if store_file is None:
+        store_file = os.path.splitext(filename)[0] + STORE_SUFFIX
+    source_meta = _source_meta(filename, file_sha256(filename)) #taken before reading, so a change during the read forces a rebuild
+    air_codes_df = pd.read_csv(filename)
+    for column in CATEGORY_COLUMNS:
+        air_codes_df[column] = air_codes_df[column].astype("category")
+    air_codes_df['lattitude'], air_codes_df['longitude'] = parse_coordinates(air_codes_df['coordinates'])
+    _write_store(pa.Table.from_pandas(air_codes_df, preserve_index=False), store_file, source_meta)
+    return store_file
+
+
+def load_airport_store(store_file: str, columns: list = None) -> object:
+    '''
+    Reads the columnar store.
+
+    Inputs:
+        str -- store_file: the Parquet file written by convert_airport_codes
+        list -- columns: the columns to read; defaults to the columns of airport_codes.csv
+
+    Returns:
+        A data frame with the requested columns, indexed by row of airport_codes.csv
+    '''
+    if columns is None:
+        columns = [column for column in pq.read_schema(store_file).names if column not in COORDINATE_COLUMNS]
+    return pd.read_parquet(store_file, columns=list(columns))
+
+
+def load_airport_codes(filename: str = "airport_codes.csv", columns: list = None, store_file: str = None) -> object:
+    '''
+    Loads airport_codes.csv through the columnar store, converting it first if the store is missing or was converted from
+    a different version of the csv file. The store is up to date if the csv file has the same modification time and size
+    it had when it was converted, or, if those changed, the same SHA-256 hash. Drop-in replacement for
+    pd.read_csv("airport_codes.csv").
+
+    Inputs:
+        str -- filename: the airport codes csv file
+        list -- columns: the columns to read, which may include "lattitude" and "longitude"; defaults to the columns of airport_codes.csv
+        str -- store_file: the Parquet file; defaults to the csv file name with a .parquet extension
+
+    Returns:
+        A data frame with the requested columns, indexed by row of airport_codes.csv
+    '''
+    if store_file is None:
+        store_file = os.path.splitext(filename)[0] + STORE_SUFFIX
+    saved_meta = _stored_source_meta(store_file)
+    source_meta = _source_meta(filename)
+    if saved_meta is None or saved_meta.get("version") != STORE_VERSION:
+        convert_airport_codes(filename, store_file)
+    elif saved_meta.get("mtime_ns") != source_meta["mtime_ns"] or saved_meta.get("size") != source_meta["size"]:
+        source_meta["sha256"] = file_sha256(filename) #the file was touched, only convert it again if its contents actually changed
+        if saved_meta.get("sha256") == source_meta["sha256"]:
+            _write_store(pq.read_table(store_file), store_file, source_meta) #restamp so the hash is not computed on every load
+        else:
+            convert_airport_codes(filename, store_file)
+    return load_airport_store(store_file, columns)
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description="Convert airport_codes.csv to a columnar Parquet store.")
+    parser.add_argument("filename", nargs="?", default="airport_codes.csv", help="the airport codes csv file")
+    parser.add_argument("--store", default=None, help="the Parquet file to write")
+    options = parser.parse_args(args)
+    print(f"airport codes written to {convert_airport_codes(options.filename, options.store)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+'''
+Batch version of Update_Travel_File_and_Calculate_Emissions.py for many travel files at once.
+
+The travel files are given as directories and/or glob patterns, e.g.
+
+    python batch_emissions.py exports/ "archive/JPM Airline Activity *.xlsx" --workers 8 --output emissions_by_file.csv
+
+The run has two parallel phases with one serial step in between:
+
+    1. each travel file is streamed, once, by a worker process to count its flights by origin/destination route;
+    2. the routes of all files are merged and modified_air_codes.csv is updated once, using the airport index and the
+       non-interactive resolver, so that every file sees the same airports;
+    3. the updated airport table is handed to every worker once, when the worker starts, and each worker passes the route
+       counts of its travel files through the distance and emissions calculations, reading the persisted route distance
+       cache; the routes the workers calculated are added to the cache file at the end. The travel files are not read again.
+
+Results are always merged in sorted file order, so the combined totals do not depend on which worker finished first.
+Directories and glob patterns only pick up files with the Origination and Destination columns, leaving out the airport
+tables, route cache and output files that usually sit next to the travel files. A file that can not be read or processed
+is reported with its error and left out of the totals rather than stopping the whole batch, and airport codes that can
+not be found in any file are listed as a warning.
+
+The module contains the functions find_travel_files, process_travel_files and main, the details of which are provided below.
+
+'''
+
+import argparse
+import glob
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from airport_fallback import DEFAULT_FALLBACK_FILE, AirportFallback, collect_code_aliases, save_fallbacks
+from airport_index import load_airport_index
+from airport_resolver import DEFAULT_OVERRIDES_FILE, AirportResolver
+from airport_store import STORE_SUFFIX, load_airport_codes
+from flight_distance import DISTANCE_MODELS, HAVERSINE, DistanceModel, build_coordinate_lookup
+from instrumentation import configure_logging
+from Update_Travel_File_and_Calculate_Emissions import append_modified_aircodes_file, calculate_route_emissions, count_travel_file
+from route_cache import DEFAULT_CACHE_FILE, RouteDistanceCache, normalize_code, route_cache_file
+from travel_reader import DEFAULT_CHUNK_ROWS, TRAVEL_COLUMNS, read_travel_columns
+
+TRAVEL_FILE_EXTENSIONS = (".xlsx", ".xlsm", ".csv", ".parquet", ".pq")
+
+_worker_aircodes_df = None #the shared airport table, set once in every worker process by _init_worker
+_worker_cache_file = None
+_worker_distance_model = HAVERSINE
+_worker_code_aliases = {}
+
+logger = logging.getLogger(__name__)
+
+
+def _is_travel_file(filename: str) -> bool:
+    try:
+        columns = read_travel_columns(filename)
+    except Exception as error: #an unreadable file is reported and skipped, like a file without the travel columns
+        logger.warning(f"skipping {filename}: {error}")
+        return False
+    if not set(TRAVEL_COLUMNS).issubset(columns):
+        logger.info(f"skipping {filename}: it has no {' and '.join(TRAVEL_COLUMNS)} columns")
+        return False
+    return True
+
+
+def find_travel_files(paths: list, exclude: list = ()) -> list:
+    '''
+    Expands directories and glob patterns into a list of travel files. Only files with the Origination and Destination
+    columns are kept.
+
+    Inputs:
+        list -- paths: directories, glob patterns or file names
+        list -- exclude: files that are never travel files, e.g. the airport tables and the output file of the run
+
+    Returns:
+        A sorted list of unique travel file names
+    '''
+    exclude = {os.path.abspath(name) for name in exclude if name}
+    travel_files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            candidates = [os.path.join(path, name) for name in os.listdir(path)]
+        else:
+            candidates = glob.glob(path)
+        for candidate in candidates:
+            name = os.path.basename(candidate)
+            if (os.path.isfile(candidate) and os.path.splitext(name)[1].lower() in TRAVEL_FILE_EXTENSIONS and not name.startswith("~$") #skip Excel lock files
+            and os.path.abspath(candidate) not in exclude):
+                travel_files.add(os.path.normpath(candidate))
+    return [name for name in sorted(travel_files) if _is_travel_file(name)]
+
+
+def _init_worker(aircodes_df: object, cache_file: str, distance_model: object = HAVERSINE, code_aliases: dict = None):
+    global _worker_aircodes_df, _worker_cache_file, _worker_distance_model, _worker_code_aliases
+    _worker_aircodes_df = aircodes_df
+    _worker_cache_file = cache_file
+    _worker_distance_model = distance_model
+    _worker_code_aliases = code_aliases or {}
+
+
+def _count_file(name: str, chunk_rows: int) -> tuple:
+    try:
+        return count_travel_file(name, None, chunk_rows), None
+    except Exception as error: #returned rather than raised so that one bad file does not stop the batch
+        return None, f"{type(error).__name__}: {error}"
+
+
+def _file_emissions(route_counts_df: object) -> tuple:
+    try:
+        route_cache = RouteDistanceCache(filename = _worker_cache_file) #workers only read the persisted routes; the parent saves new ones
+        summary_df, flight_count, _ = calculate_route_emissions(route_counts_df, _worker_aircodes_df, route_cache = route_cache,
+        distance_model = _worker_distance_model, code_aliases = _worker_code_aliases)
+    except Exception as error:
+        return None, f"{type(error).__name__}: {error}"
+    return (summary_df, flight_count, route_cache.new_routes(), route_cache.stats()), None
+
+
+def _unresolved_codes(travel_routes_df: object, aircodes_df: object, code_aliases: dict) -> list:
+    code_to_row = build_coordinate_lookup(aircodes_df[["ident", "local_code", "iata_code", "coordinates"]].reset_index(drop=True),
+    code_aliases)[0]
+    codes = pd.unique(travel_routes_df[["Origination", "Destination"]].to_numpy().ravel())
+    return sorted(str(code) for code in codes if normalize_code(code) not in code_to_row and code != "---" and pd.notna(code))
+
+
+def process_travel_files(travel_files: list, workers: int = None, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+airport_codes_file: str = "airport_codes.csv", modified_codes_file: str = "modified_air_codes.csv", cache_file: str = None,
+distance_model: object = HAVERSINE, use_fallback: bool = True) -> tuple:
+    '''
+    Calculates emissions for every travel file in a process pool.
+
+    Inputs:
+        list -- travel_files: the travel files to process
+        int -- workers: the number of worker processes; defaults to the number of cores, 1 runs everything in this process
+        int -- chunk_rows: the number of travel file rows read at once by a worker
+        str -- airport_codes_file: the full airport codes file
+        str -- modified_codes_file: the modified_air_codes.csv file to update
+        str -- cache_file: the persisted route distance cache read by every worker and updated at the end; None to not persist routes.
+        It must hold distances from distance_model (see route_cache.route_cache_file)
+        obj -- distance_model: the flight_distance.DistanceModel used by every worker
+        bool -- use_fallback: look for the closest match of airports not in airport_codes.csv (see airport_fallback); the confident
+        matches are added to airport_fallbacks.csv next to modified_codes_file
+
+    Returns:
+        A tuple (per_file_df, combined_df, failed_files): the band totals of each file, with a "file" column, the band totals of
+        all files, and a dictionary of file name -> error for the files that could not be processed, which are left out of
+        both totals
+    '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunk_rows_list = [chunk_rows] * len(travel_files)
+
+    if workers == 1:
+        counted = list(map(_count_file, travel_files, chunk_rows_list))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            counted = list(executor.map(_count_file, travel_files, chunk_rows_list)) #map returns results in input order
+    failed_files = {name: error for name, (_, error) in zip(travel_files, counted) if error is not None}
+    travel_files = [name for name, (_, error) in zip(travel_files, counted) if error is None]
+    route_frames = [route_counts_df for route_counts_df, error in counted if error is None]
+
+    air_codes_df = load_airport_codes(airport_codes_file)
+    airport_index = load_airport_index(airport_codes_file)
+    modified_aircodes_file_df = pd.read_csv(modified_codes_file, index_col = 0)
+    resolver = AirportResolver(air_codes_df)
+    fallback = AirportFallback(air_codes_df) if use_fallback else None
+    fallback_file = os.path.join(os.path.dirname(modified_codes_file), DEFAULT_FALLBACK_FILE)
+    code_aliases = collect_code_aliases(fallback_file, resolver.overrides)
+    if len(route_frames) != 0:
+        travel_routes_df = pd.concat(route_frames)[["Origination", "Destination"]].drop_duplicates()
+        modified_aircodes_file_df = append_modified_aircodes_file(travel_routes_df, modified_aircodes_file_df, air_codes_df, airport_index,
+        resolver, filename = modified_codes_file, fallback = fallback, code_aliases = code_aliases)
+    if fallback is not None and len(fallback.matches) != 0:
+        save_fallbacks(fallback.report(), fallback_file)
+        code_aliases = collect_code_aliases(fallback_file, resolver.overrides, fallback)
+
+    if len(route_frames) != 0:
+        unresolved_codes = _unresolved_codes(travel_routes_df, modified_aircodes_file_df, code_aliases)
+        if len(unresolved_codes) != 0:
+            logger.warning(f"{len(unresolved_codes)} airport codes could not be found and their flights are left out: {unresolved_codes}")
+
+    if workers == 1:
+        _init_worker(modified_aircodes_file_df, cache_file, distance_model, code_aliases)
+        processed = list(map(_file_emissions, route_frames))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(modified_aircodes_file_df, cache_file, distance_model, code_aliases)) as executor:
+            processed = list(executor.map(_file_emissions, route_frames))
+    failed_files.update({name: error for name, (_, error) in zip(travel_files, processed) if error is not None})
+    travel_files = [name for name, (_, error) in zip(travel_files, processed) if error is None]
+    results = [result for result, error in processed if error is None]
+
+    if cache_file is not None:
+        route_cache = RouteDistanceCache(filename = cache_file)
+        for result in results:
+            route_cache.update(result[2])
+        route_cache.save()
+
+    file_frames = []
+    combined_df = None
+    for name, (summary_df, flight_count, _, cache_stats) in zip(travel_files, results): #files are already sorted, so the merge order is fixed
+        combined_df = summary_df if combined_df is None else combined_df + summary_df
+        file_df = summary_df.reset_index()
+        file_df.insert(0, "route_cache_hit_rate", cache_stats["hit_rate"])
+        file_df.insert(0, "file_flights", flight_count)
+        file_df.insert(0, "file", name)
+        file_frames.append(file_df)
+
+    per_file_df = pd.concat(file_frames).reset_index(drop=True) if len(file_frames) != 0 else pd.DataFrame()
+    return per_file_df, combined_df, dict(sorted(failed_files.items()))
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description="Calculate flight emissions for many travel files in parallel.")
+    parser.add_argument("paths", nargs="+", help="travel files, directories of travel files or glob patterns")
+    parser.add_argument("--log-level", default="INFO", help="DEBUG, INFO or WARNING")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: number of cores)")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="travel file rows processed at once")
+    parser.add_argument("--airport-codes", default="airport_codes.csv", help="the full airport codes file")
+    parser.add_argument("--modified-codes", default="modified_air_codes.csv", help="the modified airport codes file to update")
+    parser.add_argument("--route-cache", default=DEFAULT_CACHE_FILE, help="persisted route distance cache ('' to disable)")
+    parser.add_argument("--output", default=None, help="csv file for the per-file band totals")
+    parser.add_argument("--distance-model", default="haversine", choices=DISTANCE_MODELS, help="spherical haversine or ellipsoidal vincenty")
+    parser.add_argument("--uplift", type=float, default=0.0, help="GCD uplift added to every distance, e.g. 0.08 for 8%%")
+    parser.add_argument("--no-fallback", action="store_true", help="leave out airports not in airport_codes.csv instead of looking for a "
+    "close match (fallbacks already in airport_fallbacks.csv are still used)")
+    options = parser.parse_args(args)
+    configure_logging(options.log_level)
+    distance_model = DistanceModel(options.distance_model, options.uplift)
+
+    cache_file = route_cache_file(distance_model.name, options.route_cache) if options.route_cache else None
+    exclude = [options.airport_codes, os.path.splitext(options.airport_codes)[0] + STORE_SUFFIX, options.modified_codes,
+    os.path.join(os.path.dirname(options.modified_codes), DEFAULT_FALLBACK_FILE), DEFAULT_OVERRIDES_FILE, cache_file, options.output]
+    travel_files = find_travel_files(options.paths, exclude)
+    if len(travel_files) == 0:
+        parser.error(f"no travel files found in {options.paths}")
+
+    per_file_df, combined_df, failed_files = process_travel_files(travel_files, options.workers, options.chunk_rows, options.airport_codes,
+    options.modified_codes, cache_file, distance_model, not options.no_fallback)
+    for name, error in failed_files.items():
+        logger.error(f"{name} was left out of the totals: {error}")
+    if combined_df is None:
+        logger.error("none of the travel files could be processed")
+        raise SystemExit(1)
+    if options.output is not None:
+        per_file_df.to_csv(options.output, index = False)
+
+    file_totals_df = per_file_df.groupby("file", sort=False)[["file_flights", "route_cache_hit_rate", "flights", "kg_co2", "tonnes_co2"]].agg(
+        {"file_flights": "first", "route_cache_hit_rate": "first", "flights": "sum", "kg_co2": "sum", "tonnes_co2": "sum"})
+    logger.info(f"emissions by file:\n{file_totals_df}")
+    unresolved_df = file_totals_df[file_totals_df["file_flights"] > file_totals_df["flights"]]
+    for name, file_totals in unresolved_df.iterrows():
+        logger.warning(f"{int(file_totals['file_flights'] - file_totals['flights'])} flights in {name} were left out because their origin or "
+        "destination could not be found")
+    logger.info(f"emissions by band:\n{combined_df}")
+    logger.info(f"total Bates CO2 for {len(travel_files) - len(failed_files)} travel files is {combined_df['kg_co2'].sum()}kg ({combined_df['tonnes_co2'].sum()} metric tons)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+'''
+Benchmark of the distance models in flight_distance.py: throughput and error against a reference.
+
+Random airport pairs are generated over the whole globe (with a share of short hops, as in real travel files) and every
+model is timed on them. Errors are measured against a reference distance on the WGS-84 ellipsoid from Karney's geodesic
+algorithm in geographiclib, which is independent of the Vincenty implementation being measured. geographiclib is required
+(pip install geographiclib); without it the benchmark is skipped with a message. The models compared are
+
+    haversine, haversine with an 8% GCD uplift, and vincenty at several tolerances
+
+    python benchmarks/bench_distance_models.py --sizes 10000 1000000 --output distance_models.json
+
+Each entry holds the model, the number of pairs, the time of every repeat, the median time, the pairs per second and the
+mean, 99th percentile and maximum error in miles and as a percentage of the reference distance.
+
+'''
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    from geographiclib.geodesic import Geodesic
+except ImportError:
+    Geodesic = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) #the scripts live in the repository root
+
+from flight_distance import KM_PER_MILE, DistanceModel
+
+MODELS = {
+    "haversine": DistanceModel("haversine"),
+    "haversine_uplift_8": DistanceModel("haversine", uplift=0.08),
+    "vincenty": DistanceModel("vincenty"),
+    "vincenty_tol_1e-9": DistanceModel("vincenty", tolerance=1e-9),
+    "vincenty_tol_1e-6": DistanceModel("vincenty", tolerance=1e-6),
+}
+
+
+def make_pairs(pairs: int, short_share: float = 0.3, seed: int = 0) -> tuple:
+    '''
+    Generates random origin/destination coordinates.
+
+    Inputs:
+        int -- pairs: the number of pairs
+        float -- short_share: the share of pairs whose destination lies within about 5 degrees of the origin
+        int -- seed: the random seed
+
+    Returns:
+        A tuple (orig_lattitude, orig_longitude, dest_lattitude, dest_longitude) of float Numpy arrays in degrees
+    '''
+    rng = np.random.default_rng(seed)
+    orig_lattitude = np.degrees(np.arcsin(rng.uniform(-1, 1, pairs))) #uniform over the sphere
+    orig_longitude = rng.uniform(-180, 180, pairs)
+    dest_lattitude = np.degrees(np.arcsin(rng.uniform(-1, 1, pairs)))
+    dest_longitude = rng.uniform(-180, 180, pairs)
+    short = rng.random(pairs) < short_share
+    dest_lattitude[short] = np.clip(orig_lattitude[short] + rng.uniform(-5, 5, short.sum()), -90, 90)
+    dest_longitude[short] = (orig_longitude[short] + rng.uniform(-5, 5, short.sum()) + 180) % 360 - 180
+    return orig_lattitude, orig_longitude, dest_lattitude, dest_longitude
+
+
+def reference_miles(orig_lattitude: object, orig_longitude: object, dest_lattitude: object, dest_longitude: object) -> tuple:
+    '''
+    Computes the reference distances with geographiclib, which is slow because it works one pair at a time.
+
+    Returns:
+        A tuple (reference, name): the reference distances in miles and the name of the method used
+    '''
+    geodesic = Geodesic.WGS84
+    meters = [geodesic.Inverse(*pair)["s12"] for pair in zip(orig_lattitude, orig_longitude, dest_lattitude, dest_longitude)]
+    return np.array(meters) / 1000 / KM_PER_MILE, "geographiclib"
+
+
+def bench_models(pairs: int, repeat: int, reference_pairs: int, models: list, seed: int) -> list:
+    '''
+    Times every model on one set of pairs and measures its error on the first reference_pairs of them.
+
+    Returns:
+        A list of result dictionaries, one per model
+    '''
+    coordinates = make_pairs(pairs, seed = seed)
+    sample = [values[:reference_pairs] for values in coordinates]
+    reference, reference_name = reference_miles(*sample)
+
+    results = []
+    for name in models:
+        model = MODELS[name]
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            model(*coordinates)
+            seconds.append(time.perf_counter() - start)
+
+        error = model(*sample) - reference
+        valid = ~np.isnan(error) & (reference > 0)
+        percent_error = 100 * np.abs(error[valid]) / reference[valid]
+        results.append({
+            "model": name,
+            "pairs": pairs,
+            "reference": reference_name,
+            "reference_pairs": int(valid.sum()),
+            "seconds": seconds,
+            "median_seconds": statistics.median(seconds),
+            "pairs_per_second": pairs / statistics.median(seconds) if statistics.median(seconds) > 0 else None,
+            "mean_abs_error_miles": float(np.mean(np.abs(error[valid]))),
+            "p99_abs_error_miles": float(np.percentile(np.abs(error[valid]), 99)),
+            "max_abs_error_miles": float(np.max(np.abs(error[valid]))),
+            "mean_error_percent": float(np.mean(percent_error)),
+            "max_error_percent": float(np.max(percent_error)),
+        })
+    return results
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description="Benchmark the speed and accuracy of the flight distance models.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 1000000], help="numbers of airport pairs timed")
+    parser.add_argument("--models", nargs="+", default=list(MODELS), choices=list(MODELS))
+    parser.add_argument("--reference-pairs", type=int, default=10000, help="pairs compared against the reference distance")
+    parser.add_argument("--repeat", type=int, default=3, help="timed calls per model")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON file for the results (printed when not given)")
+    options = parser.parse_args(args)
+    if Geodesic is None:
+        print("skipped: geographiclib is needed for the reference distances (pip install geographiclib)", file=sys.stderr)
+        return
+
+    results = []
+    for pairs in options.sizes:
+        size_results = bench_models(pairs, options.repeat, options.reference_pairs, options.models, options.seed)
+        for result in size_results:
+            print(f"{result['model']:<20} pairs={pairs:<10} median={result['median_seconds']:.4f}s "
+            f"mean_error={result['mean_error_percent']:.5f}% max_error={result['max_error_percent']:.5f}%", file=sys.stderr)
+        results.extend(size_results)
+
+    report = {
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+        "platform": platform.platform(), "cpu_count": os.cpu_count()},
+        "results": results,
+    }
+    if options.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(options.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+'''
+Benchmark of the hot paths of Create_Truncated_Codes_File_FINAL.py and Update_Travel_File_and_Calculate_Emissions.py on
+synthetic data.
+
+For every travel file size a synthetic airport table and travel table are generated (see synthetic_data.py), written to a
+temporary directory, and the following functions are timed:
+
+    load_travel (reading the travel file in the chosen format), read_airport_codes_csv, build_airport_index, unique_airports,
+    create_modif_airport_codes, update_modified_aircodes_file, calculate_flight_distance, calculate_emissions
+
+along with the production paths the scripts now run in their place:
+
+    count_travel_file, load_airport_codes and load_airport_index (with the store and index already on disk, and "_cold"
+    when they are converted or built first), distances_from_lookup, calculate_route_emissions (from the route counts) and
+    calculate_streamed_emissions (from the travel file)
+
+The results are written as JSON so that runs can be compared over time, e.g.
+
+    python benchmarks/bench_hot_paths.py --sizes 1000 100000 1000000 --output bench_results.json
+
+Each entry holds the function, the legacy function it is compared with (for a production path), the data set parameters,
+the time of every repeat and the median time in seconds.
+
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) #the scripts live in the repository root
+
+from airport_index import INDEX_SUFFIX, build_airport_index, load_airport_index
+from airport_resolver import AirportResolver
+from airport_store import STORE_SUFFIX, load_airport_codes
+from flight_distance import build_coordinate_lookup, distances_from_lookup
+from flight_pipeline import load_travel
+from Create_Truncated_Codes_File_FINAL import create_modif_airport_codes, unique_airports
+from Update_Travel_File_and_Calculate_Emissions import (calculate_emissions, calculate_flight_distance, calculate_route_emissions,
+calculate_streamed_emissions, count_travel_file, update_modified_aircodes_file)
+from synthetic_data import make_airport_codes, make_travel, write_travel
+
+BENCHMARKED_FUNCTIONS = ["load_travel", "count_travel_file", "read_airport_codes_csv", "load_airport_codes", "load_airport_codes_cold",
+"build_airport_index", "load_airport_index", "load_airport_index_cold", "unique_airports", "create_modif_airport_codes",
+"update_modified_aircodes_file", "calculate_flight_distance", "distances_from_lookup", "calculate_emissions", "calculate_route_emissions",
+"calculate_streamed_emissions"]
+BASELINES = { #production path -> the legacy function it replaces
+    "count_travel_file": "load_travel",
+    "load_airport_codes": "read_airport_codes_csv",
+    "load_airport_codes_cold": "read_airport_codes_csv",
+    "load_airport_index": "build_airport_index",
+    "load_airport_index_cold": "build_airport_index",
+    "distances_from_lookup": "calculate_flight_distance",
+    "calculate_route_emissions": "calculate_emissions",
+    "calculate_streamed_emissions": "calculate_emissions",
+}
+
+
+def time_call(function, repeat: int) -> list:
+    '''
+    Calls function repeat times with its printed output suppressed.
+
+    Inputs:
+        obj -- function: a function taking no arguments
+        int -- repeat: the number of calls
+
+    Returns:
+        A list with the time of each call in seconds
+    '''
+    seconds = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def bench_size(rows: int, airports: int, unique_codes: int, ambiguity_rate: float, repeat: int, functions: list, file_format: str,
+seed: int) -> list:
+    '''
+    Generates one data set and times every requested function on it.
+
+    Returns:
+        A list of result dictionaries, one per function
+    '''
+    air_codes_df = make_airport_codes(airports, ambiguity_rate = ambiguity_rate, seed = seed)
+    travel_df = make_travel(rows, air_codes_df, unique_codes, seed = seed)
+    results = []
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        cwd = os.getcwd()
+        os.chdir(work_dir) #the scripts write modified_air_codes.csv and their debug files to the working directory
+        try:
+            air_codes_df.to_csv("airport_codes.csv", index = False)
+            write_travel(travel_df, f"travel.{file_format}")
+            air_codes_df = pd.read_csv("airport_codes.csv") #read back so dtypes match what the scripts see
+            airport_index = build_airport_index(air_codes_df)
+            resolver = AirportResolver(air_codes_df, overrides = {})
+            airports_list = unique_airports(travel_df)
+
+            rows_in_aircodes = sorted({row for code in airports_list for row in airport_index.lookup(code)[:1]})
+            known_rows = rows_in_aircodes[:len(rows_in_aircodes) // 2] #half of the travel airports are already in modified_air_codes.csv
+            modified_aircodes_file_df = air_codes_df.iloc[known_rows]
+            modified_aircodes_file_df.to_csv("modified_air_codes.csv", index = True)
+            modified_aircodes_file_df = pd.read_csv("modified_air_codes.csv", index_col = 0)
+            full_aircodes_df = air_codes_df.iloc[rows_in_aircodes]
+            alt_travel_df = travel_df[["Origination", "Destination"]].copy().reset_index()
+            short_air_df = full_aircodes_df[["local_code", "iata_code", "coordinates"]].copy().reset_index()
+            coordinate_lookup = build_coordinate_lookup(full_aircodes_df[["ident", "local_code", "iata_code", "coordinates"]].reset_index())
+            route_counts_df = count_travel_file(f"travel.{file_format}")
+            load_airport_index("airport_codes.csv") #converts the airport store and builds the index, so the warm loads find both on disk
+
+            def cold(function, path):
+                def call():
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+                    return function("airport_codes.csv")
+                return call
+
+            calls = {
+                "load_travel": lambda: load_travel(f"travel.{file_format}"),
+                "count_travel_file": lambda: count_travel_file(f"travel.{file_format}"),
+                "read_airport_codes_csv": lambda: pd.read_csv("airport_codes.csv"),
+                "load_airport_codes": lambda: load_airport_codes("airport_codes.csv"),
+                "load_airport_codes_cold": cold(load_airport_codes, "airport_codes" + STORE_SUFFIX),
+                "build_airport_index": lambda: build_airport_index(air_codes_df),
+                "load_airport_index": lambda: load_airport_index("airport_codes.csv"),
+                "load_airport_index_cold": cold(load_airport_index, "airport_codes.csv" + INDEX_SUFFIX),
+                "unique_airports": lambda: unique_airports(travel_df),
+                "create_modif_airport_codes": lambda: create_modif_airport_codes(air_codes_df, airports_list, airport_index, resolver),
+                "update_modified_aircodes_file": lambda: update_modified_aircodes_file(travel_df, modified_aircodes_file_df, air_codes_df,
+                airport_index, resolver, filename = "bench_modified_air_codes.csv"),
+                "calculate_flight_distance": lambda: calculate_flight_distance(alt_travel_df, short_air_df),
+                "distances_from_lookup": lambda: distances_from_lookup(travel_df["Origination"], travel_df["Destination"], coordinate_lookup),
+                "calculate_emissions": lambda: calculate_emissions(travel_df, full_aircodes_df),
+                "calculate_route_emissions": lambda: calculate_route_emissions(route_counts_df, full_aircodes_df),
+                "calculate_streamed_emissions": lambda: calculate_streamed_emissions(f"travel.{file_format}", full_aircodes_df),
+            }
+            for name in functions:
+                seconds = time_call(calls[name], repeat)
+                results.append({
+                    "function": name,
+                    "baseline": BASELINES.get(name),
+                    "rows": rows,
+                    "airports": airports,
+                    "unique_codes": unique_codes,
+                    "ambiguity_rate": ambiguity_rate,
+                    "file_format": file_format,
+                    "seconds": seconds,
+                    "median_seconds": statistics.median(seconds),
+                    "rows_per_second": rows / statistics.median(seconds) if statistics.median(seconds) > 0 else None,
+                })
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description="Benchmark the flight emissions hot paths on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="travel file sizes in rows (1k to 10M)")
+    parser.add_argument("--airports", type=int, default=70000, help="rows in the synthetic airport table")
+    parser.add_argument("--unique-codes", type=int, nargs="+", default=[300], help="distinct airports used by the travel data")
+    parser.add_argument("--ambiguity-rates", type=float, nargs="+", default=[0.02], help="share of ambiguous airport rows")
+    parser.add_argument("--functions", nargs="+", default=BENCHMARKED_FUNCTIONS, choices=BENCHMARKED_FUNCTIONS)
+    parser.add_argument("--repeat", type=int, default=3, help="timed calls per function")
+    parser.add_argument("--format", dest="file_format", default="csv", choices=["csv", "xlsx", "parquet"], help="travel file format written")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON file for the results (printed when not given)")
+    options = parser.parse_args(args)
+
+    results = []
+    for rows in options.sizes:
+        for unique_codes in options.unique_codes:
+            for ambiguity_rate in options.ambiguity_rates:
+                size_results = bench_size(rows, options.airports, unique_codes, ambiguity_rate, options.repeat, options.functions,
+                options.file_format, options.seed)
+                for result in size_results:
+                    print(f"{result['function']:<30} rows={rows:<10} unique_codes={unique_codes:<6} ambiguity={ambiguity_rate:<6} "
+                    f"median={result['median_seconds']:.4f}s", file=sys.stderr)
+                results.extend(size_results)
+
+    report = {
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+        "platform": platform.platform(), "cpu_count": os.cpu_count()},
+        "results": results,
+    }
+    if options.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(options.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+'''
+Generators for synthetic airport and travel data used by the benchmarks.
+
+make_airport_codes builds a table with the same columns as airport_codes.csv and make_travel builds a JPM-style travel table
+whose Origination and Destination columns use codes from that airport table. Sizes, the number of unique codes in the
+travel data, the share of ambiguous codes (codes that appear on more than one airport row) and the share of "---"
+placeholders can all be varied. Every generator takes a seed so that benchmark runs are repeatable.
+
+The module contains the functions make_airport_codes, make_travel and write_travel, the details of which are provided below.
+
+'''
+
+import string
+
+import numpy as np
+import pandas as pd
+
+AIRPORT_CODES_COLUMNS = ['ident', 'type', 'name', 'elevation_ft', 'continent', 'iso_country', 'iso_region', 'municipality',
+'gps_code', 'iata_code', 'local_code', 'coordinates']
+AIRPORT_TYPES = ['large_airport', 'medium_airport', 'small_airport', 'heliport', 'seaplane_base', 'closed']
+AIRPORT_TYPE_WEIGHTS = [0.01, 0.06, 0.55, 0.25, 0.02, 0.11] #roughly the mix found in airport_codes.csv
+EXCEL_MAX_ROWS = 1048575 #an xlsx sheet holds 1,048,576 rows including the header
+
+
+def _codes(count: int, length: int, alphabet: str) -> object:
+    '''
+    Returns count distinct codes of the given length, in a fixed order.
+    '''
+    base = len(alphabet)
+    if count > base**length:
+        raise ValueError(f"Only {base**length} codes of length {length} exist")
+    numbers = np.arange(count)
+    chars = []
+    for _ in range(length):
+        chars.append(np.array(list(alphabet))[numbers % base])
+        numbers = numbers // base
+    return np.array(["".join(code) for code in zip(*reversed(chars))])
+
+
+def make_airport_codes(airports: int = 70000, iata_share: float = 0.13, ambiguity_rate: float = 0.02, seed: int = 0) -> object:
+    '''
+    Builds a synthetic airport_codes.csv table.
+
+    Inputs:
+        int -- airports: the number of rows
+        float -- iata_share: the share of rows with an iata_code (every row gets a local_code)
+        float -- ambiguity_rate: the share of rows whose local_code is copied from another row's code, making that code ambiguous
+        int -- seed: the random seed
+
+    Returns:
+        A data frame with the columns of airport_codes.csv
+    '''
+    rng = np.random.default_rng(seed)
+    letters = string.ascii_uppercase
+    iata_count = min(int(airports * iata_share), len(letters)**3)
+    iata_codes = np.full(airports, None, dtype=object)
+    iata_rows = rng.choice(airports, iata_count, replace=False)
+    iata_codes[iata_rows] = rng.permutation(_codes(iata_count, 3, letters))
+    local_codes = rng.permutation(_codes(airports, 4, letters + string.digits)).astype(object) #four characters never clash with an iata_code
+    local_codes[iata_rows] = iata_codes[iata_rows] #airports with an iata_code usually use it as their local_code too
+
+    ambiguous_rows = rng.choice(airports, int(airports * ambiguity_rate), replace=False)
+    source_rows = rng.choice(airports, len(ambiguous_rows))
+    local_codes[ambiguous_rows] = np.where(pd.notna(iata_codes[source_rows]), iata_codes[source_rows], local_codes[source_rows])
+
+    lattitude = rng.uniform(-60, 70, airports)
+    longitude = rng.uniform(-180, 180, airports)
+    return pd.DataFrame({
+        'ident': np.char.add("X", np.arange(airports).astype(str)),
+        'type': rng.choice(AIRPORT_TYPES, airports, p=AIRPORT_TYPE_WEIGHTS),
+        'name': np.char.add("Airport ", np.arange(airports).astype(str)),
+        'elevation_ft': rng.integers(0, 10000, airports),
+        'continent': rng.choice(['NA', 'EU', 'AS', 'AF', 'SA', 'OC'], airports),
+        'iso_country': rng.choice(['US', 'CA', 'GB', 'FR', 'JP', 'BR'], airports),
+        'iso_region': rng.choice(['US-ME', 'US-MA', 'CA-QC', 'GB-ENG', 'FR-IDF', 'JP-13'], airports),
+        'municipality': np.char.add("City ", rng.integers(0, airports // 3 + 1, airports).astype(str)),
+        'gps_code': local_codes,
+        'iata_code': iata_codes,
+        'local_code': local_codes,
+        'coordinates': [f"{lon}, {lat}" for lon, lat in zip(longitude, lattitude)],
+    }, columns=AIRPORT_CODES_COLUMNS)
+
+
+def make_travel(rows: int, air_codes_df: object, unique_codes: int = 300, placeholder_rate: float = 0.01, seed: int = 0) -> object:
+    '''
+    Builds a synthetic travel table. A few airports account for most flights, as in the real travel files.
+
+    Inputs:
+        int -- rows: the number of flights
+        obj -- air_codes_df: the airport table the codes are drawn from
+        int -- unique_codes: the number of distinct airports used by the flights
+        float -- placeholder_rate: the share of origins and destinations replaced by "---"
+        int -- seed: the random seed
+
+    Returns:
+        A data frame with the columns Traveler, Department, Departure Date, Origination and Destination
+    '''
+    rng = np.random.default_rng(seed)
+    codes = pd.concat([air_codes_df['iata_code'], air_codes_df['local_code']]).dropna().unique()
+    pool = rng.choice(codes, min(unique_codes, len(codes)), replace=False)
+    weights = 1.0 / np.arange(1, len(pool) + 1) #Zipf-like popularity
+    weights = weights / weights.sum()
+
+    origination = rng.choice(pool, rows, p=weights).astype(object)
+    destination = rng.choice(pool, rows, p=weights).astype(object)
+    origination[rng.random(rows) < placeholder_rate] = "---"
+    destination[rng.random(rows) < placeholder_rate] = "---"
+
+    return pd.DataFrame({
+        'Traveler': np.char.add("T", rng.integers(0, max(rows // 20, 1), rows).astype(str)),
+        'Department': rng.choice(['Biology', 'Chemistry', 'Economics', 'History', 'Athletics', 'Admissions'], rows),
+        'Departure Date': pd.Timestamp("2020-07-01") + pd.to_timedelta(rng.integers(0, 365, rows), unit="D"),
+        'Origination': origination,
+        'Destination': destination,
+    })
+
+
+def write_travel(travel_df: object, filename: str):
+    '''
+    Writes a travel table as .xlsx, .csv or .parquet depending on the file extension.
+
+    Inputs:
+        obj -- travel_df: the travel table
+        str -- filename: the file to write
+    '''
+    if filename.endswith(".xlsx"):
+        if len(travel_df) > EXCEL_MAX_ROWS:
+            raise ValueError(f"An xlsx sheet holds at most {EXCEL_MAX_ROWS} rows; use .csv or .parquet for {len(travel_df)} rows")
+        travel_df.to_excel(filename, index = False)
+    elif filename.endswith(".parquet"):
+        travel_df.to_parquet(filename, index = False)
+    else:
+        travel_df.to_csv(filename, index = False)
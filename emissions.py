@@ -0,0 +1,109 @@
+'''
+Vectorized emissions calculation for flight distances.
+
+Every flight distance is placed in a haul band at once with Numpy and multiplied by that band's emissions factor. The bands
+are a table rather than an if/elif ladder so that the thresholds and factors can be changed (or read from a csv file)
+without touching the code. The default factors are from the EPA and are in kg CO2 per passenger mile:
+
+    short haul:  less than 300 miles            0.2081145 kg CO2
+    medium haul: 300 miles up to 2300 miles     0.1322666 kg CO2
+    long haul:   2300 miles or more             0.1625348 kg CO2
+
+The module contains the functions load_emission_bands, classify_emissions and summarize_emissions, the details of which
+are provided below.
+
+'''
+
+import numpy as np
+import pandas as pd
+
+BAND_COLUMNS = ["band", "min_miles", "max_miles", "kg_co2_per_mile"]
+EMISSION_BANDS = pd.DataFrame({
+    "band": ["short_haul", "medium_haul", "long_haul"],
+    "min_miles": [0.0, 300.0, 2300.0],
+    "max_miles": [300.0, 2300.0, np.inf],
+    "kg_co2_per_mile": [0.2081145, 0.1322666, 0.1625348],
+})
+SUMMARY_COLUMNS = ["flights", "distance_miles", "kg_co2", "tonnes_co2"]
+
+
+def _check_bands(bands: object):
+    if not set(BAND_COLUMNS).issubset(bands.columns):
+        raise ValueError(f"The emission bands table needs the columns {BAND_COLUMNS}")
+    min_miles = bands["min_miles"].to_numpy(dtype=float)
+    max_miles = bands["max_miles"].to_numpy(dtype=float)
+    if np.any(np.diff(min_miles) <= 0):
+        raise ValueError("The emission bands must be sorted by min_miles")
+    if np.any(max_miles[:-1] != min_miles[1:]): #contiguous bands mean no distance can fall between two of them
+        raise ValueError("Each emission band must start where the previous one ends")
+
+
+def load_emission_bands(filename: str) -> object:
+    '''
+    Reads a table of emission bands from a csv file.
+
+    Inputs:
+        str -- filename: a csv file with the columns band, min_miles, max_miles and kg_co2_per_mile; use "inf" for an open upper bound
+
+    Returns:
+        A data frame of emission bands sorted by min_miles
+    '''
+    bands = pd.read_csv(filename)
+    bands = bands.sort_values("min_miles").reset_index(drop=True)
+    _check_bands(bands)
+    return bands
+
+
+def classify_emissions(flight_distance: object, bands: object = EMISSION_BANDS) -> object:
+    '''
+    Bins every flight distance into a haul band and calculates its emissions.
+
+    Inputs:
+        obj -- flight_distance: array-like of flight distances in miles; NaN for flights whose airports could not be found
+        obj -- bands: the table of emission bands, EMISSION_BANDS by default
+
+    Returns:
+        A data frame with one row per flight and the columns distance_miles, band, kg_co2 and tonnes_co2. Flights with no
+        distance, or a distance outside every band, have no band and NaN emissions
+    '''
+    _check_bands(bands)
+    distances = np.asarray(flight_distance, dtype=float)
+    min_miles = bands["min_miles"].to_numpy(dtype=float)
+    max_miles = bands["max_miles"].to_numpy(dtype=float)
+
+    band_pos = np.searchsorted(min_miles, distances, side="right") - 1 #the last band whose lower bound is at or below the distance
+    in_band = (band_pos >= 0) & ~np.isnan(distances)
+    in_band[in_band] = distances[in_band] < max_miles[band_pos[in_band]]
+
+    kg_co2 = np.full(len(distances), np.nan)
+    kg_co2[in_band] = distances[in_band] * bands["kg_co2_per_mile"].to_numpy(dtype=float)[band_pos[in_band]]
+    band_names = pd.Categorical.from_codes(np.where(in_band, band_pos, -1), categories=bands["band"])
+
+    return pd.DataFrame({"distance_miles": distances, "band": band_names, "kg_co2": kg_co2, "tonnes_co2": kg_co2/1000})
+
+
+def summarize_emissions(segments_df: object, weights: object = None) -> object:
+    '''
+    Totals the per-flight results of classify_emissions by band. The totals of several travel files (or several chunks of
+    one file) can be combined by adding their summaries together.
+
+    Inputs:
+        obj -- segments_df: the data frame returned by classify_emissions
+        obj -- weights: optional array-like with the number of flights each row stands for, e.g. when segments_df holds one
+        row per route of a travel file (see travel_reader.count_travel_routes); every row is one flight by default
+
+    Returns:
+        A data frame indexed by band, including bands with no flights, with the columns flights, distance_miles, kg_co2
+        and tonnes_co2
+    '''
+    weights = np.ones(len(segments_df), dtype=np.int64) if weights is None else np.asarray(weights, dtype=np.int64)
+    weighted_df = pd.DataFrame({
+        "band": segments_df["band"].array, #kept categorical so that bands with no flights are still listed
+        "flights": np.where(segments_df["kg_co2"].notna().to_numpy(), weights, 0),
+        "distance_miles": segments_df["distance_miles"].to_numpy() * weights,
+        "kg_co2": segments_df["kg_co2"].to_numpy() * weights,
+        "tonnes_co2": segments_df["tonnes_co2"].to_numpy() * weights,
+    })
+    summary_df = weighted_df.groupby("band", observed=False)[SUMMARY_COLUMNS].sum()
+    summary_df["flights"] = summary_df["flights"].astype(np.int64)
+    return summary_df[SUMMARY_COLUMNS]
@@ -0,0 +1,335 @@
+'''
+Batched great-circle distance engine used by Update_Travel_File_and_Calculate_Emissions.py.
+
+Rather than walking the airport table once per origin and once more per destination, every airport code in the
+airport table is resolved to a pair of coordinate arrays in a single pass. The origin and destination columns of the
+travel file are then turned into index arrays into those coordinate arrays and a distance model is applied to all
+flights at once with Numpy.
+
+Two distance models are available, chosen at run time with DistanceModel:
+
+    haversine: great-circle distance on a 6371 km sphere; fastest, and off by up to about 0.5% on long hauls
+    vincenty:  Vincenty's inverse formula on the WGS-84 ellipsoid, iterated on all flights at once until every flight
+               has converged to within the tolerance or max_iterations is reached
+
+Either model can add a great-circle distance (GCD) uplift, e.g. 0.08 for the 8% that some reporting standards add to
+account for routing and holding. Routes already in a route_cache.RouteDistanceCache skip the model entirely.
+
+Airport codes are compared after route_cache.normalize_code, so " bos" in a travel file finds the airport whose iata_code
+is "BOS". Both ends of a flight are resolved to airports before the route cache is consulted, and the cache is keyed on
+the idents of those airports, so a cached distance is only used for a route whose codes still resolve, and to the same
+airports.
+
+The module contains the DistanceModel class and the functions parse_coordinates, build_coordinate_lookup, resolve_codes,
+haversine_miles, vincenty_miles, calculate_distances and distances_from_lookup, the details of which are provided below.
+
+'''
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+from route_cache import normalize_code
+
+EARTH_RADIUS_KM = 6371 #radius of a spherical earth, same value used by the original per-row calculation
+KM_PER_MILE = 1.60934
+WGS84_A = 6378137.0 #semi-major axis of the WGS-84 ellipsoid in meters
+WGS84_F = 1 / 298.257223563 #flattening of the WGS-84 ellipsoid
+VINCENTY_TOLERANCE = 1e-12 #change in lambda, in radians, at which an iteration has converged (about 0.006 mm)
+VINCENTY_MAX_ITERATIONS = 200
+
+
+def parse_coordinates(coordinates: object) -> tuple:
+    '''
+    Splits the "coordinates" column of the airport table, stored as "longitude, lattitude" strings, into two float arrays.
+
+    Inputs:
+        obj -- coordinates: a Pandas series of "longitude, lattitude" strings
+
+    Returns:
+        A tuple (lattitude, longitude) of float Numpy arrays in degrees; entries that can not be parsed are NaN
+    '''
+    split_coords = coordinates.astype(str).str.split(",", n=1, expand=True) #one vectorized split instead of a find(",") per row
+    if split_coords.shape[1] < 2: #no entry contained a comma at all
+        nan_arr = np.full(len(coordinates), np.nan)
+        return nan_arr, nan_arr.copy()
+    longitude = pd.to_numeric(split_coords[0], errors="coerce").to_numpy(dtype=float)
+    lattitude = pd.to_numeric(split_coords[1], errors="coerce").to_numpy(dtype=float)
+    return lattitude, longitude
+
+
+def build_coordinate_lookup(short_air_df: object, code_aliases: dict = None) -> tuple:
+    '''
+    Builds a dictionary mapping every local_code and iata_code in the airport table, normalized with
+    route_cache.normalize_code, to a row position, along with the parsed coordinate arrays for those rows. As with the
+    original row-by-row search, when a code appears on more than one row the last matching row wins.
+
+    Inputs:
+        obj -- short_air_df: data frame with at least the "local_code", "iata_code" and "coordinates" columns
+        dict -- code_aliases: optional mapping of codes to the ident of an airport, e.g. from airport_fallback.load_fallbacks or airport_resolver.load_overrides;
+        short_air_df then also needs the "ident" column. Aliases are applied after the table, so an alias replaces the row of a
+        local_code or iata_code carried by several rows and an override settles which of them the distance stage uses
+
+    Returns:
+        A tuple (code_to_row, lattitude, longitude, idents) where code_to_row is a dict, lattitude/longitude are float arrays
+        and idents is the array of airport idents by row, or None if short_air_df has no "ident" column
+    '''
+    lattitude, longitude = parse_coordinates(short_air_df["coordinates"])
+    local_codes = short_air_df["local_code"].to_numpy()
+    iata_codes = short_air_df["iata_code"].to_numpy()
+    idents = short_air_df["ident"].to_numpy() if "ident" in short_air_df.columns else None
+
+    code_to_row = {}
+    for row in range(len(local_codes)): #a single pass over the airport table; later rows overwrite earlier ones
+        for code in (normalize_code(local_codes[row]), normalize_code(iata_codes[row])):
+            if code is not None:
+                code_to_row[code] = row
+    if code_aliases:
+        ident_rows = {ident: row for row, ident in enumerate(idents)}
+        for code, ident in code_aliases.items():
+            code = normalize_code(code)
+            if code is not None and ident in ident_rows:
+                code_to_row[code] = ident_rows[ident]
+    return code_to_row, lattitude, longitude, idents
+
+
+def resolve_codes(codes: object, code_to_row: dict) -> object:
+    '''
+    Converts an array of airport codes to an array of row positions in the coordinate arrays.
+
+    Inputs:
+        obj -- codes: array-like of airport codes from the travel file
+        dict -- code_to_row: the mapping produced by build_coordinate_lookup
+
+    Returns:
+        An integer Numpy array of row positions, -1 where a code could not be found (including "---" placeholders)
+    '''
+    codes_series = pd.Series(codes)
+    inverse, uniques = pd.factorize(codes_series) #travel files repeat the same airports, so only look each unique code up once
+    unique_rows = np.array([code_to_row.get(normalize_code(code), -1) for code in uniques], dtype=np.int64)
+    rows = np.full(len(codes_series), -1, dtype=np.int64)
+    found = inverse >= 0 #factorize marks missing values with -1
+    rows[found] = unique_rows[inverse[found]]
+    return rows
+
+
+def haversine_miles(orig_lattitude: object, orig_longitude: object, dest_lattitude: object, dest_longitude: object) -> object:
+    '''
+    Vectorized Haversine formula for a spherical earth (https://www.movable-type.co.uk/scripts/latlong.html).
+
+    Inputs:
+        obj -- orig_lattitude, orig_longitude: origin coordinates in degrees as Numpy arrays
+        obj -- dest_lattitude, dest_longitude: destination coordinates in degrees as Numpy arrays
+
+    Returns:
+        A float Numpy array of distances in miles
+    '''
+    orig_latt_rad = np.radians(orig_lattitude) #coordinates always come in degree pairs, so we must convert our data to radians
+    dest_latt_rad = np.radians(dest_lattitude)
+    orig_long_rad = np.radians(orig_longitude)
+    dest_long_rad = np.radians(dest_longitude)
+
+    a = np.sin((dest_latt_rad - orig_latt_rad)/2.0)**2 + \
+    np.cos(orig_latt_rad) * np.cos(dest_latt_rad) * np.sin((dest_long_rad - orig_long_rad)/2.0)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return (EARTH_RADIUS_KM * c) / KM_PER_MILE
+
+
+def vincenty_miles(orig_lattitude: object, orig_longitude: object, dest_lattitude: object, dest_longitude: object,
+tolerance: float = VINCENTY_TOLERANCE, max_iterations: int = VINCENTY_MAX_ITERATIONS) -> object:
+    '''
+    Vectorized Vincenty inverse formula for the WGS-84 ellipsoid (https://www.movable-type.co.uk/scripts/latlong-vincenty.html).
+    Every flight is iterated at once and flights drop out of the iteration as they converge. Nearly antipodal flights may
+    not converge; their spherical distance is used instead and a warning is logged.
+
+    Inputs:
+        obj -- orig_lattitude, orig_longitude: origin coordinates in degrees as Numpy arrays
+        obj -- dest_lattitude, dest_longitude: destination coordinates in degrees as Numpy arrays
+        float -- tolerance: the change in lambda, in radians, below which a flight has converged
+        int -- max_iterations: the maximum number of iterations
+
+    Returns:
+        A float Numpy array of distances in miles
+    '''
+    orig_lattitude = np.asarray(orig_lattitude, dtype=float)
+    orig_longitude = np.asarray(orig_longitude, dtype=float)
+    dest_lattitude = np.asarray(dest_lattitude, dtype=float)
+    dest_longitude = np.asarray(dest_longitude, dtype=float)
+    b = (1 - WGS84_F) * WGS84_A
+
+    L = np.radians(dest_longitude - orig_longitude)
+    U1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(orig_lattitude))) #reduced lattitudes
+    U2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(dest_lattitude)))
+    sin_U1, cos_U1, sin_U2, cos_U2 = np.sin(U1), np.cos(U1), np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    sin_sigma = np.zeros_like(L)
+    cos_sigma = np.ones_like(L)
+    sigma = np.zeros_like(L)
+    cos_sq_alpha = np.ones_like(L)
+    cos_2sigma_m = np.zeros_like(L)
+    valid = ~np.isnan(L + U1 + U2)
+    active = np.flatnonzero(valid) #flights still iterating
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for _ in range(max_iterations):
+            if len(active) == 0:
+                break
+            sin_lam, cos_lam = np.sin(lam[active]), np.cos(lam[active])
+            s_U1, c_U1, s_U2, c_U2 = sin_U1[active], cos_U1[active], sin_U2[active], cos_U2[active]
+            sin_sig = np.sqrt((c_U2 * sin_lam)**2 + (c_U1 * s_U2 - s_U1 * c_U2 * cos_lam)**2)
+            cos_sig = s_U1 * s_U2 + c_U1 * c_U2 * cos_lam
+            sig = np.arctan2(sin_sig, cos_sig)
+            sin_alpha = np.where(sin_sig == 0, 0.0, c_U1 * c_U2 * sin_lam / sin_sig) #sin_sig == 0 for coincident airports
+            cos_sq = 1 - sin_alpha**2
+            cos_2sm = np.where(cos_sq == 0, 0.0, cos_sig - 2 * s_U1 * s_U2 / cos_sq) #cos_sq == 0 along the equator
+            C = WGS84_F / 16 * cos_sq * (4 + WGS84_F * (4 - 3 * cos_sq))
+            new_lam = L[active] + (1 - C) * WGS84_F * sin_alpha * (sig + C * sin_sig * (cos_2sm + C * cos_sig * (-1 + 2 * cos_2sm**2)))
+
+            sin_sigma[active], cos_sigma[active], sigma[active] = sin_sig, cos_sig, sig
+            cos_sq_alpha[active], cos_2sigma_m[active] = cos_sq, cos_2sm
+            converged = np.abs(new_lam - lam[active]) <= tolerance
+            lam[active] = new_lam
+            active = active[~converged]
+
+        u_sq = cos_sq_alpha * (WGS84_A**2 - b**2) / b**2
+        A = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        B = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (cos_sigma * (-1 + 2 * cos_2sigma_m**2)
+        - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma**2) * (-3 + 4 * cos_2sigma_m**2)))
+        miles = b * A * (sigma - delta_sigma) / 1000 / KM_PER_MILE
+    miles[~valid] = np.nan
+
+    if len(active) != 0:
+        logging.getLogger(__name__).warning("Vincenty's formula did not converge for %d flights; their spherical distance is used",
+        len(active))
+        miles[active] = haversine_miles(orig_lattitude[active], orig_longitude[active], dest_lattitude[active], dest_longitude[active])
+    return miles
+
+
+class DistanceModel:
+    '''
+    A distance model chosen at run time: the model used for the great-circle distance plus an optional uplift.
+
+    Inputs:
+        str -- name: "haversine" or "vincenty"
+        float -- uplift: fraction added to every distance, e.g. 0.08 for an 8% GCD uplift; 0 for none
+        float -- tolerance: the convergence tolerance of the vincenty model
+        int -- max_iterations: the maximum number of iterations of the vincenty model
+    '''
+
+    def __init__(self, name: str = "haversine", uplift: float = 0.0, tolerance: float = VINCENTY_TOLERANCE,
+    max_iterations: int = VINCENTY_MAX_ITERATIONS):
+        if name not in DISTANCE_MODELS:
+            raise ValueError(f"Unknown distance model {name}; expected one of {list(DISTANCE_MODELS)}")
+        if uplift < 0:
+            raise ValueError("The GCD uplift can not be negative")
+        self.name = name
+        self.uplift = uplift
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+
+    def great_circle_miles(self, orig_lattitude: object, orig_longitude: object, dest_lattitude: object, dest_longitude: object) -> object:
+        '''
+        Returns:
+            A float Numpy array of distances in miles without the uplift; these are what the route cache stores
+        '''
+        if self.name == "vincenty":
+            return vincenty_miles(orig_lattitude, orig_longitude, dest_lattitude, dest_longitude, self.tolerance, self.max_iterations)
+        return haversine_miles(orig_lattitude, orig_longitude, dest_lattitude, dest_longitude)
+
+    def apply_uplift(self, miles: object) -> object:
+        '''
+        Returns:
+            The distances with the uplift added
+        '''
+        return miles * (1 + self.uplift) if self.uplift != 0 else miles
+
+    def __call__(self, orig_lattitude: object, orig_longitude: object, dest_lattitude: object, dest_longitude: object) -> object:
+        return self.apply_uplift(self.great_circle_miles(orig_lattitude, orig_longitude, dest_lattitude, dest_longitude))
+
+    def __repr__(self) -> str:
+        return f"DistanceModel({self.name!r}, uplift={self.uplift})"
+
+
+DISTANCE_MODELS = ("haversine", "vincenty")
+HAVERSINE = DistanceModel("haversine")
+
+
+def calculate_distances(orig_codes: object, dest_codes: object, short_air_df: object, distance_model: DistanceModel = HAVERSINE) -> object:
+    '''
+    Computes the great-circle distance of every flight in one batch.
+
+    Inputs:
+        obj -- orig_codes: array-like of origin airport codes
+        obj -- dest_codes: array-like of destination airport codes
+        obj -- short_air_df: data frame with the "local_code", "iata_code" and "coordinates" columns
+        obj -- distance_model: the DistanceModel used; haversine without uplift by default
+
+    Returns:
+        A float Numpy array of distances in miles; NaN where either airport could not be found
+    '''
+    return distances_from_lookup(orig_codes, dest_codes, build_coordinate_lookup(short_air_df), distance_model = distance_model)
+
+
+def distances_from_lookup(orig_codes: object, dest_codes: object, coordinate_lookup: tuple, route_cache: object = None,
+distance_model: DistanceModel = HAVERSINE) -> object:
+    '''
+    Same as calculate_distances but with a lookup that was already built, so that callers processing a travel file in
+    chunks only parse the airport table once. Both codes of every flight are first resolved to airports, and distances
+    are calculated once per pair of airports rather than once per flight, so A to B and B to A (or "bos" and "BOS") share
+    one calculation. The route cache is keyed on the pair of airport idents and is only read or written for flights whose
+    origin and destination both resolve, so a flight whose codes no longer resolve (or now resolve to another airport)
+    never picks up a cached distance.
+
+    Inputs:
+        obj -- orig_codes: array-like of origin airport codes
+        obj -- dest_codes: array-like of destination airport codes
+        tuple -- coordinate_lookup: the (code_to_row, lattitude, longitude, idents) tuple produced by build_coordinate_lookup
+        obj -- route_cache: an optional route_cache.RouteDistanceCache that is read from and filled in; it must only hold
+        distances from the same model as distance_model (see route_cache.route_cache_file). The lookup then needs idents
+        obj -- distance_model: the DistanceModel used; haversine without uplift by default
+
+    Returns:
+        A float Numpy array of distances in miles; NaN where either airport could not be found
+    '''
+    code_to_row, lattitude, longitude, idents = coordinate_lookup
+    if route_cache is not None and idents is None:
+        raise ValueError("The route cache is keyed on airport idents; build the lookup from a table with the ident column")
+    orig_codes = pd.Series(orig_codes, dtype=object).to_numpy()
+    raw_ids, raw_codes = pd.factorize(np.concatenate([orig_codes, pd.Series(dest_codes, dtype=object).to_numpy()])) #missing codes get -1
+    code_rows = np.array([code_to_row.get(normalize_code(code), -1) for code in raw_codes], dtype=np.int64) #each unique code is
+    #looked up once; unknown and blank codes get -1
+    flight_rows = np.append(code_rows, -1)[raw_ids] #a raw id of -1 picks the appended -1
+    orig_rows, dest_rows = flight_rows[:len(orig_codes)], flight_rows[len(orig_codes):]
+
+    found = (orig_rows >= 0) & (dest_rows >= 0) #flights whose origin or destination is unknown keep a NaN distance
+    first_rows = np.minimum(orig_rows[found], dest_rows[found]) #A to B and B to A share a key, as in route_cache.route_key
+    second_rows = np.maximum(orig_rows[found], dest_rows[found])
+    key_ids = np.full(len(orig_codes), -1, dtype=np.int64)
+    key_ids[found], unique_keys = pd.factorize(first_rows * len(lattitude) + second_rows)
+    key_orig = unique_keys // len(lattitude) if len(lattitude) != 0 else unique_keys
+    key_dest = unique_keys % len(lattitude) if len(lattitude) != 0 else unique_keys
+
+    key_distances = np.full(len(unique_keys), np.nan)
+    to_calculate = np.ones(len(unique_keys), dtype=bool)
+    if route_cache is not None:
+        for key in range(len(unique_keys)):
+            cached_distance = route_cache.get(idents[key_orig[key]], idents[key_dest[key]])
+            if cached_distance is not None:
+                key_distances[key] = cached_distance
+                to_calculate[key] = False
+
+    orig_key_rows, dest_key_rows = key_orig[to_calculate], key_dest[to_calculate]
+    calculated = distance_model.great_circle_miles(lattitude[orig_key_rows], longitude[orig_key_rows], lattitude[dest_key_rows],
+    longitude[dest_key_rows])
+    key_distances[to_calculate] = calculated
+
+    if route_cache is not None:
+        for orig_row, dest_row, distance in zip(orig_key_rows, dest_key_rows, calculated):
+            route_cache.put(idents[orig_row], idents[dest_row], distance)
+
+    flight_distances = np.full(len(orig_codes), np.nan)
+    flight_distances[found] = key_distances[key_ids[found]]
+    return distance_model.apply_uplift(flight_distances) #the cache holds distances without the uplift
@@ -0,0 +1,246 @@
+'''
+Single-pass flight emissions pipeline.
+
+Running Create_Truncated_Codes_File_FINAL.py and then Update_Travel_File_and_Calculate_Emissions.py reads the travel file and
+airport_codes.csv twice, writes modified_air_codes.csv only to read it back, and writes alt_travel_df.csv and short_air_df.csv
+for debugging. The pipeline here runs the same stages as one call and hands in-memory data from one stage to the next:
+
+    load -> resolve airport codes -> distances -> emissions
+
+Each input file is read once. Nothing is written unless asked for: modified_air_codes.csv is only appended to when
+update_modified_codes is True, and the intermediate files alt_travel_df.csv and short_air_df.csv are only written when
+write_intermediates is True.
+
+    python flight_pipeline.py "JPM Airline Activity 7.1.2020 - 6.30.21 for Tom.xlsx" --modified-codes modified_air_codes.csv
+
+The module contains the PipelineResult tuple and the functions load_travel, resolve_airports, compute_segments,
+run_pipeline and main, the details of which are provided below.
+
+'''
+
+import argparse
+import logging
+import os
+from collections import namedtuple
+
+import pandas as pd
+
+from airport_fallback import DEFAULT_FALLBACK_FILE, AirportFallback, collect_code_aliases, save_fallbacks
+from airport_index import build_airport_index
+from airport_resolver import AirportResolver
+from airport_store import load_airport_codes
+from emissions import EMISSION_BANDS, classify_emissions, summarize_emissions
+from flight_distance import DISTANCE_MODELS, HAVERSINE, DistanceModel, build_coordinate_lookup, distances_from_lookup
+from instrumentation import configure_logging
+from travel_reader import DEFAULT_CHUNK_ROWS, TRAVEL_COLUMNS, iter_travel_chunks
+from travel_rollups import (DATE_COLUMN, ROLLUPS, TRAVELER_COLUMN, assign_itineraries, rollup_emissions, rollup_source_columns,
+summarize_itineraries, write_rollups)
+from Update_Travel_File_and_Calculate_Emissions import append_airport_rows, find_missing_airport_rows
+
+PipelineResult = namedtuple("PipelineResult", ["segments_df", "summary_df", "aircodes_df", "unresolved_airports", "fallback_df"])
+PipelineResult.__doc__ = '''Result of run_pipeline: the per-flight emissions, the totals by band, the airports used, the codes that could not be found and the airports found by the fallback'''
+
+logger = logging.getLogger(__name__)
+
+
+def load_travel(travel_file: str, chunk_rows: int = DEFAULT_CHUNK_ROWS, extra_columns: tuple = ()) -> object:
+    '''
+    Reads the Origination and Destination columns of a travel file.
+
+    Inputs:
+        str -- travel_file: the travel file (.xlsx, .csv or .parquet)
+        int -- chunk_rows: the number of rows read at once
+        tuple -- extra_columns: other travel file columns to read, e.g. the traveler and department
+
+    Returns:
+        A data frame with the "Origination" and "Destination" columns followed by extra_columns
+    '''
+    columns = list(dict.fromkeys(list(TRAVEL_COLUMNS) + list(extra_columns)))
+    chunks = list(iter_travel_chunks(travel_file, columns, chunk_rows))
+    if len(chunks) == 0:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks).reset_index(drop=True)
+
+
+def resolve_airports(travel_df: object, air_codes_df: object, airport_index: object = None, resolver: object = None,
+modified_aircodes_file_df: object = None, fallback: object = None, code_aliases: dict = None) -> tuple:
+    '''
+    Finds the airport_codes.csv row of every airport in the travel data. Airports already in modified_aircodes_file_df are
+    taken from there, as are codes that code_aliases points at one of its airports; the rest are looked up in the airport index.
+
+    Inputs:
+        obj -- travel_df: data frame with the "Origination" and "Destination" columns
+        obj -- air_codes_df: the airport_codes.csv data frame
+        obj -- airport_index: the AirportIndex for airport_codes.csv; built from air_codes_df if not provided
+        obj -- resolver: the AirportResolver used when an airport matches several rows
+        obj -- modified_aircodes_file_df: the modified_air_codes.csv data frame, if there is one
+        obj -- fallback: an optional airport_fallback.AirportFallback used for codes that are not in airport_codes.csv
+        dict -- code_aliases: codes mapped to the ident of the airport to use, as passed to flight_distance.build_coordinate_lookup
+
+    Returns:
+        A tuple (aircodes_df, unresolved_airports): the rows of modified_aircodes_file_df followed by the rows of every airport
+        found, in the modified_air_codes.csv format, and the sorted list of codes that could not be found
+    '''
+    if modified_aircodes_file_df is None:
+        modified_aircodes_file_df = air_codes_df.iloc[0:0]
+    known_codes = set(pd.concat([modified_aircodes_file_df['local_code'], modified_aircodes_file_df['iata_code']]).dropna())
+    file_idents = set(modified_aircodes_file_df['ident'])
+    known_codes.update(code for code, ident in (code_aliases or {}).items() if ident in file_idents)
+    travel_codes = set(pd.concat([travel_df['Origination'], travel_df['Destination']]).dropna())
+    travel_codes.discard('---')
+    missing_airports = sorted(travel_codes - known_codes)
+    if len(missing_airports) == 0:
+        return modified_aircodes_file_df, []
+
+    if airport_index is None:
+        airport_index = build_airport_index(air_codes_df)
+    rows_in_aircodes_final, removal_list = find_missing_airport_rows(missing_airports, air_codes_df, airport_index, resolver, fallback)
+    new_rows = list(dict.fromkeys(row[0] for row in rows_in_aircodes_final if row[0] not in modified_aircodes_file_df.index)) #two codes can resolve to one airport
+    new_df = air_codes_df.iloc[new_rows].reindex(columns = modified_aircodes_file_df.columns)
+    return pd.concat([modified_aircodes_file_df, new_df]), sorted(removal_list)
+
+
+def compute_segments(travel_df: object, aircodes_df: object, bands: object = EMISSION_BANDS, route_cache: object = None,
+distance_model: object = HAVERSINE, code_aliases: dict = None) -> object:
+    '''
+    Calculates the distance and emissions of every flight.
+
+    Inputs:
+        obj -- travel_df: data frame with the "Origination" and "Destination" columns and any other travel columns to carry through
+        obj -- aircodes_df: the airports used by the travel data, as returned by resolve_airports
+        obj -- bands: the table of haul bands and emissions factors
+        obj -- route_cache: an optional route_cache.RouteDistanceCache holding distances from distance_model
+        obj -- distance_model: the flight_distance.DistanceModel used for the flight distances
+        dict -- code_aliases: travel file codes mapped to the ident of the airport to use, e.g. the codes found by the fallback
+
+    Returns:
+        A data frame with every column of travel_df followed by the distance_miles, band, kg_co2 and tonnes_co2 of every flight
+    '''
+    coordinate_lookup = build_coordinate_lookup(aircodes_df[["ident", "local_code", "iata_code", "coordinates"]].reset_index(drop=True),
+    code_aliases)
+    flight_distance = distances_from_lookup(travel_df["Origination"].to_numpy(), travel_df["Destination"].to_numpy(), coordinate_lookup,
+    route_cache, distance_model)
+    segments_df = classify_emissions(flight_distance, bands)
+    return pd.concat([travel_df.reset_index(drop=True), segments_df], axis=1)
+
+
+def run_pipeline(travel_file: str, airport_codes_file: str = "airport_codes.csv", modified_codes_file: str = None,
+update_modified_codes: bool = False, write_intermediates: bool = False, output_dir: str = ".", resolver: object = None,
+bands: object = EMISSION_BANDS, route_cache: object = None, chunk_rows: int = DEFAULT_CHUNK_ROWS, extra_columns: tuple = (),
+distance_model: object = HAVERSINE, fallback: object = None, use_fallback: bool = True) -> PipelineResult:
+    '''
+    Runs every stage from the input files to the emissions totals, reading each input file once.
+
+    Inputs:
+        str -- travel_file: the travel file (.xlsx, .csv or .parquet)
+        str -- airport_codes_file: the full airport codes file
+        str -- modified_codes_file: an existing modified_air_codes.csv whose airports are used first; None to resolve every airport from airport_codes_file
+        bool -- update_modified_codes: append the airports found that are missing from modified_codes_file to it (the file is
+        created if needed)
+        bool -- write_intermediates: write alt_travel_df.csv and short_air_df.csv to output_dir
+        str -- output_dir: the directory for the intermediate files
+        obj -- resolver: the AirportResolver used when an airport matches several rows; ranks candidates using airport_overrides.csv if not provided
+        obj -- bands: the table of haul bands and emissions factors
+        obj -- route_cache: an optional route_cache.RouteDistanceCache holding distances from distance_model
+        int -- chunk_rows: the number of travel file rows read at once
+        tuple -- extra_columns: other travel file columns carried through to segments_df, e.g. for travel_rollups
+        obj -- distance_model: the flight_distance.DistanceModel used for the flight distances
+        obj -- fallback: the airport_fallback.AirportFallback used for codes that are not in airport_codes.csv; built from
+        airport_codes_file if not provided. The fallbacks already in airport_fallbacks.csv (next to modified_codes_file) are
+        always used, and with update_modified_codes the new confident matches are added to it (see airport_fallback.save_fallbacks)
+        bool -- use_fallback: False to leave out flights whose codes are not in airport_codes.csv instead of using the fallback
+
+    Returns:
+        A PipelineResult
+    '''
+    travel_df = load_travel(travel_file, chunk_rows, extra_columns)
+    air_codes_df = load_airport_codes(airport_codes_file)
+    airport_index = build_airport_index(air_codes_df) #built from the data frame in memory rather than reading the file a second time
+    if resolver is None:
+        resolver = AirportResolver(air_codes_df)
+    if not use_fallback:
+        fallback = None
+    elif fallback is None:
+        fallback = AirportFallback(air_codes_df)
+
+    modified_aircodes_file_df = None
+    if modified_codes_file is not None:
+        if os.path.exists(modified_codes_file):
+            modified_aircodes_file_df = pd.read_csv(modified_codes_file, index_col = 0)
+        elif update_modified_codes:
+            modified_aircodes_file_df = air_codes_df.iloc[0:0]
+            modified_aircodes_file_df.to_csv(modified_codes_file, index = True, index_label = None)
+
+    if update_modified_codes and modified_codes_file is None:
+        raise ValueError("update_modified_codes needs a modified_codes_file")
+    if modified_codes_file is None:
+        fallback_file = DEFAULT_FALLBACK_FILE
+    else:
+        fallback_file = os.path.join(os.path.dirname(modified_codes_file), DEFAULT_FALLBACK_FILE)
+    code_aliases = collect_code_aliases(fallback_file, resolver.overrides)
+
+    aircodes_df, unresolved_airports = resolve_airports(travel_df, air_codes_df, airport_index, resolver, modified_aircodes_file_df,
+    fallback, code_aliases) #the missing codes are searched for, and the fallback run, once for both the file update and the distances
+    if update_modified_codes:
+        append_airport_rows(aircodes_df.iloc[len(modified_aircodes_file_df):], modified_codes_file) #the rows found by resolve_airports
+
+    fallback_df = pd.DataFrame() if fallback is None else fallback.report()
+    if update_modified_codes and len(fallback_df) != 0:
+        save_fallbacks(fallback_df, fallback_file)
+    code_aliases = collect_code_aliases(fallback_file, resolver.overrides, fallback)
+
+    segments_df = compute_segments(travel_df, aircodes_df, bands, route_cache, distance_model, code_aliases)
+    summary_df = summarize_emissions(segments_df)
+
+    if write_intermediates:
+        travel_df.reset_index().to_csv(os.path.join(output_dir, "alt_travel_df.csv"))
+        aircodes_df[["local_code", "iata_code", "coordinates"]].reset_index().to_csv(os.path.join(output_dir, "short_air_df.csv"))
+
+    return PipelineResult(segments_df, summary_df, aircodes_df, unresolved_airports, fallback_df)
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description="Calculate flight emissions for a travel file in a single pass.")
+    parser.add_argument("travel_file", help="the travel file (.xlsx, .csv or .parquet)")
+    parser.add_argument("--log-level", default="INFO", help="DEBUG, INFO or WARNING")
+    parser.add_argument("--airport-codes", default="airport_codes.csv", help="the full airport codes file")
+    parser.add_argument("--modified-codes", default=None, help="an existing modified_air_codes.csv whose airports are used first")
+    parser.add_argument("--update-modified-codes", action="store_true", help="append new airports to the --modified-codes file")
+    parser.add_argument("--write-intermediates", action="store_true", help="write alt_travel_df.csv and short_air_df.csv")
+    parser.add_argument("--output-dir", default=".", help="directory for the intermediate files")
+    parser.add_argument("--segments", default=None, help="csv file for the per-flight results")
+    parser.add_argument("--rollups", nargs="+", default=[], choices=list(ROLLUPS), help="also total emissions by these groupings")
+    parser.add_argument("--rollup-dir", default=".", help="directory for the rollup_<name>.csv files")
+    parser.add_argument("--itineraries", default=None, help="csv file for the multi-leg itineraries reconstructed from the flights")
+    parser.add_argument("--distance-model", default="haversine", choices=DISTANCE_MODELS, help="spherical haversine or ellipsoidal vincenty")
+    parser.add_argument("--uplift", type=float, default=0.0, help="GCD uplift added to every distance, e.g. 0.08 for 8%%")
+    parser.add_argument("--no-fallback", action="store_true", help="leave out airports not in airport_codes.csv instead of looking for a close match")
+    options = parser.parse_args(args)
+    configure_logging(options.log_level)
+
+    rollups = {rollup: ROLLUPS[rollup] for rollup in options.rollups}
+    extra_columns = rollup_source_columns(rollups)
+    if options.itineraries is not None:
+        extra_columns = list(dict.fromkeys(extra_columns + [TRAVELER_COLUMN, DATE_COLUMN]))
+    result = run_pipeline(options.travel_file, options.airport_codes, options.modified_codes, options.update_modified_codes,
+    options.write_intermediates, options.output_dir, extra_columns = extra_columns,
+    distance_model = DistanceModel(options.distance_model, options.uplift), use_fallback = not options.no_fallback)
+    segments_df = result.segments_df
+    if options.itineraries is not None:
+        segments_df = assign_itineraries(segments_df)
+        summarize_itineraries(segments_df).to_csv(options.itineraries)
+    if options.segments is not None:
+        segments_df.to_csv(options.segments, index = False)
+    if len(rollups) != 0:
+        logger.info(f"rollups written to {write_rollups(rollup_emissions(segments_df, rollups), options.rollup_dir)}")
+
+    logger.info(f"emissions by band:\n{result.summary_df}")
+    logger.info(f"total Bates CO2 for {len(result.segments_df)} flights is {result.summary_df['kg_co2'].sum()}kg ({result.summary_df['tonnes_co2'].sum()} metric tons)")
+    if len(result.fallback_df) != 0:
+        logger.warning(f"These airports are not in airport_codes.csv and were replaced by the closest match:\n{result.fallback_df}")
+    if len(result.unresolved_airports) != 0:
+        logger.warning(f"The airports {result.unresolved_airports} could not be found; flights to or from them are left out")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+'''
+Stage-level timing and memory instrumentation for the flight emissions scripts.
+
+A RunRecorder is created at the start of a run and every stage of the run is wrapped in recorder.stage(name). For each
+stage the recorder keeps the number of calls, the wall time, the rows processed and the peak memory, and at the end of the
+run write_report saves everything as a JSON run report. Stages with the same name are added together, so a stage that
+runs once per chunk of the travel file shows up as a single entry.
+
+The memory of a stage is always recorded as peak_rss_growth_mb, the amount by which the stage raised the peak resident set
+size of the process (the largest over its calls). A stage that stays within the memory already reached by an earlier stage
+shows 0; the peak of the whole run is reported as peak_rss_mb. In deep mode the recorder also runs tracemalloc, which
+records peak_traced_mb, the peak memory allocated by Python while the stage ran over what was already allocated when it
+started, and the top allocation sites, and cProfile, whose statistics are saved next to the report (the report name with
+".prof" appended). Deep mode slows the run down considerably and is meant for investigating a slow run rather than for
+every run.
+
+cProfile only profiles the thread that created the recorder, and tracemalloc has a single peak for the whole process, so
+in deep mode stages must run one at a time on that thread; see Update_Travel_File_and_Calculate_Emissions.load_inputs.
+Stages running at the same time in other threads also share one process peak, so their peak_rss_growth_mb overlap.
+
+The module contains the RunRecorder class and the function configure_logging, the details of which are provided below.
+
+'''
+
+import cProfile
+import datetime
+import json
+import logging
+import platform
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource #not available on Windows
+except ImportError:
+    resource = None
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+def configure_logging(level: str = "INFO"):
+    '''
+    Sets up logging for a script run.
+
+    Inputs:
+        str -- level: the lowest level shown, e.g. "DEBUG", "INFO" or "WARNING"
+    '''
+    logging.basicConfig(level=getattr(logging, level.upper()), format=LOG_FORMAT)
+
+
+def _peak_rss_mb() -> float:
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 #ru_maxrss is in kilobytes on Linux
+
+
+class RunRecorder:
+    '''
+    Records the wall time, rows processed and peak memory of each stage of a run.
+
+    Inputs:
+        str -- name: the name of the run, e.g. the script being run
+        bool -- deep: if True, also run tracemalloc and cProfile for the whole run
+    '''
+
+    def __init__(self, name: str, deep: bool = False):
+        self.name = name
+        self.deep = deep
+        self.stages = {} #stage name -> totals, in the order the stages first ran
+        self.started_at = datetime.datetime.now().isoformat(timespec="seconds")
+        self._start = time.perf_counter()
+        self._profiler = None
+        self._traced_peaks = [] #peak traced memory so far of each stage currently running, outermost first
+        if deep:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    @contextmanager
+    def stage(self, name: str, rows: int = None):
+        '''
+        Context manager timing one stage. The rows processed can be given up front or set on the yielded dict, e.g.
+
+            with recorder.stage("read_travel_file") as stage:
+                travel_df = read_travel_file()
+                stage["rows"] = len(travel_df)
+
+        Inputs:
+            str -- name: the name of the stage
+            int -- rows: the number of rows processed, if known before the stage runs
+        '''
+        stage_info = {"rows": rows}
+        if self.deep:
+            if len(self._traced_peaks) != 0: #keep the enclosing stage's peak before it is reset for this one
+                self._traced_peaks[-1] = max(self._traced_peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            start_traced = tracemalloc.get_traced_memory()[0] #memory already allocated when the stage starts is not the stage's
+            self._traced_peaks.append(start_traced)
+        start_peak_rss_mb = _peak_rss_mb()
+        start = time.perf_counter()
+        try:
+            yield stage_info
+        finally:
+            seconds = time.perf_counter() - start
+            totals = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "rows": None, "peak_rss_growth_mb": None, "peak_traced_mb": None})
+            totals["calls"] = totals["calls"] + 1
+            totals["seconds"] = totals["seconds"] + seconds
+            if stage_info["rows"] is not None:
+                totals["rows"] = (totals["rows"] or 0) + int(stage_info["rows"])
+            if start_peak_rss_mb is not None:
+                totals["peak_rss_growth_mb"] = max(totals["peak_rss_growth_mb"] or 0.0, _peak_rss_mb() - start_peak_rss_mb)
+            if self.deep:
+                peak_traced = max(self._traced_peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if len(self._traced_peaks) != 0:
+                    self._traced_peaks[-1] = max(self._traced_peaks[-1], peak_traced)
+                totals["peak_traced_mb"] = max(totals["peak_traced_mb"] or 0.0, (peak_traced - start_traced) / 2**20)
+            logging.getLogger(__name__).debug("stage %s took %.3fs (rows=%s)", name, seconds, stage_info["rows"])
+
+    def report(self) -> dict:
+        '''
+        Returns:
+            The run report as a dictionary: run details, the totals of every stage, and in deep mode the top allocation sites
+        '''
+        stages = []
+        for name, totals in self.stages.items():
+            stage_report = {"stage": name}
+            stage_report.update(totals)
+            stage_report["rows_per_second"] = totals["rows"] / totals["seconds"] if totals["rows"] and totals["seconds"] > 0 else None
+            stages.append(stage_report)
+
+        run_report = {
+            "run": self.name,
+            "started_at": self.started_at,
+            "total_seconds": time.perf_counter() - self._start,
+            "peak_rss_mb": _peak_rss_mb(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "stages": stages,
+        }
+        if self.deep and tracemalloc.is_tracing():
+            top_stats = tracemalloc.take_snapshot().statistics("lineno")[:10]
+            run_report["top_allocations"] = [{"location": str(stat.traceback), "size_mb": stat.size / 2**20, "count": stat.count}
+            for stat in top_stats]
+        return run_report
+
+    def write_report(self, filename: str = "run_report.json") -> dict:
+        '''
+        Saves the run report as JSON. In deep mode the cProfile statistics are saved as well, to filename + ".prof", and can
+        be read with pstats or a viewer such as snakeviz.
+
+        Inputs:
+            str -- filename: the JSON file to write
+
+        Returns:
+            The run report as a dictionary
+        '''
+        if self._profiler is not None:
+            self._profiler.disable()
+        run_report = self.report()
+        if self._profiler is not None:
+            self._profiler.dump_stats(filename + ".prof")
+            run_report["profile"] = filename + ".prof"
+        with open(filename, "w") as file:
+            json.dump(run_report, file, indent=2)
+        logging.getLogger(__name__).info("run report written to %s", filename)
+        return run_report
@@ -0,0 +1,209 @@
+'''
+Route distance cache for flight_distance.py.
+
+Travel files are highly repetitive: a handful of origin/destination pairs make up most of the flights. The
+RouteDistanceCache remembers the distance of every route it has seen, keyed on the pair of airport idents the flight's
+codes resolved to (see flight_distance.distances_from_lookup), so that a distance is only calculated the first time a
+route appears. A flight from A to B and a flight from B to A share the same entry. Because the key is the resolved
+airport rather than the travel file code, an override or fallback that points a code at another airport, or a code that
+no longer resolves, never picks up a distance cached for the old airport.
+
+The cache has two tiers:
+
+    1. an in-memory tier holding at most max_routes routes, with the least recently used route dropped first;
+    2. an optional persisted tier, a csv file with the columns origin_ident, destination_ident and distance_miles, which
+       is read when the cache is created and written by save() so that later runs can reuse it. A file written by older
+       versions, keyed on codes (columns origin and destination), is ignored and replaced on the next save().
+
+The persisted tier does not know where its distances came from. If the coordinates of an airport in modified_air_codes.csv
+are corrected, delete the cache file (or call clear()) so that the affected routes are calculated again. Distances from
+different distance models are kept in different files (see route_cache_file); the cache never holds the GCD uplift.
+
+The module contains the RouteDistanceCache class and the functions normalize_code, route_key and route_cache_file, the details of which
+are provided below.
+
+'''
+
+import os
+from collections import OrderedDict
+
+import pandas as pd
+
+DEFAULT_MAX_ROUTES = 100000
+DEFAULT_CACHE_FILE = "route_distance_cache.csv"
+CACHE_COLUMNS = ["origin_ident", "destination_ident", "distance_miles"]
+
+
+def normalize_code(code: object) -> str:
+    '''
+    Normalizes an airport code for lookups: surrounding spaces are removed and letters are upper-cased.
+
+    Inputs:
+        obj -- code: an airport code from the travel file or the airport table
+
+    Returns:
+        The normalized code, or None if the code is missing or blank
+    '''
+    if not isinstance(code, str):
+        return None
+    code = code.strip().upper()
+    return code if code != "" else None
+
+
+def route_key(origin: object, destination: object) -> tuple:
+    '''
+    Normalizes a pair of airport codes or idents so that equivalent routes share a key.
+
+    Inputs:
+        obj -- origin: the origin airport code or ident
+        obj -- destination: the destination airport code or ident
+
+    Returns:
+        A tuple of the two codes, normalized with normalize_code, in sorted order, or None if either code is missing
+    '''
+    origin = normalize_code(origin)
+    destination = normalize_code(destination)
+    if origin is None or destination is None:
+        return None
+    return (origin, destination) if origin <= destination else (destination, origin)
+
+
+def route_cache_file(model_name: str = "haversine", filename: str = DEFAULT_CACHE_FILE) -> str:
+    '''
+    Names the persisted cache file for a distance model, so that distances from different models are never mixed.
+
+    Inputs:
+        str -- model_name: the name of the flight_distance.DistanceModel
+        str -- filename: the cache file of the haversine model
+
+    Returns:
+        filename for the haversine model, otherwise filename with the model name added before the extension, e.g.
+        "route_distance_cache.vincenty.csv"
+    '''
+    if model_name == "haversine":
+        return filename
+    root, extension = os.path.splitext(filename)
+    return f"{root}.{model_name}{extension}"
+
+
+class RouteDistanceCache:
+    '''
+    Two-tier cache of route distances in miles.
+
+    Inputs:
+        int -- max_routes: the maximum number of routes kept in the in-memory tier
+        str -- filename: the csv file backing the persisted tier; None for an in-memory cache only
+    '''
+
+    def __init__(self, max_routes: int = DEFAULT_MAX_ROUTES, filename: str = None):
+        self.max_routes = max_routes
+        self.filename = filename
+        self._memory = OrderedDict()
+        self._persisted = {}
+        self._new_routes = {} #routes calculated during this run, written to the persisted tier by save()
+        self.hits = 0
+        self.persisted_hits = 0
+        self.misses = 0
+        if filename is not None and os.path.exists(filename):
+            cache_df = pd.read_csv(filename, keep_default_na=False, dtype={"origin_ident": str, "destination_ident": str})
+            if set(CACHE_COLUMNS) <= set(cache_df.columns): #a cache keyed on codes by an older version is not used
+                self._persisted = dict(zip(zip(cache_df["origin_ident"], cache_df["destination_ident"]),
+                cache_df["distance_miles"].astype(float)))
+
+    def _remember(self, key: tuple, distance: float):
+        self._memory[key] = distance
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_routes:
+            self._memory.popitem(last=False)
+
+    def get(self, origin: object, destination: object) -> float:
+        '''
+        Looks a route up, first in memory and then in the persisted tier.
+
+        Inputs:
+            obj -- origin, destination: the idents of the airports of the route
+
+        Returns:
+            The distance in miles, or None if the route has not been seen
+        '''
+        key = route_key(origin, destination)
+        if key is None:
+            return None
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits = self.hits + 1
+            return self._memory[key]
+        if key in self._persisted:
+            self.persisted_hits = self.persisted_hits + 1
+            self._remember(key, self._persisted[key])
+            return self._persisted[key]
+        self.misses = self.misses + 1
+        return None
+
+    def put(self, origin: object, destination: object, distance: float):
+        '''
+        Stores the distance of a route. Routes with a missing ident or no distance are not stored.
+
+        Inputs:
+            obj -- origin, destination: the idents of the airports of the route
+            float -- distance: the distance in miles
+        '''
+        key = route_key(origin, destination)
+        if key is None or distance is None or distance != distance: #distance != distance is only true for NaN
+            return
+        self._remember(key, float(distance))
+        if key not in self._persisted:
+            self._new_routes[key] = float(distance)
+
+    def new_routes(self) -> dict:
+        '''
+        Returns the routes calculated since the cache was created (or last saved), keyed by route_key.
+        '''
+        return dict(self._new_routes)
+
+    def update(self, routes: dict):
+        '''
+        Adds routes calculated elsewhere, e.g. by worker processes, to both tiers.
+
+        Inputs:
+            dict -- routes: mapping of route_key to distance in miles
+        '''
+        for key, distance in routes.items():
+            self._remember(key, distance)
+            if key not in self._persisted:
+                self._new_routes[key] = distance
+
+    def save(self, filename: str = None):
+        '''
+        Writes the persisted tier, including every route calculated during this run, to a csv file.
+
+        Inputs:
+            str -- filename: the file to write; defaults to the file the cache was created with
+        '''
+        filename = self.filename if filename is None else filename
+        if filename is None:
+            raise ValueError("No file was given for the persisted route cache")
+        self._persisted.update(self._new_routes)
+        self._new_routes = {}
+        routes = sorted(self._persisted.items())
+        cache_df = pd.DataFrame({"origin_ident": [key[0] for key, _ in routes], "destination_ident": [key[1] for key, _ in routes],
+        "distance_miles": [distance for _, distance in routes]})
+        cache_df.to_csv(filename, index = False)
+
+    def clear(self):
+        '''
+        Empties both tiers; the persisted file is overwritten the next time save() is called.
+        '''
+        self._memory.clear()
+        self._persisted = {}
+        self._new_routes = {}
+
+    def stats(self) -> dict:
+        '''
+        Returns:
+            A dict with the number of memory hits, persisted hits and misses, the overall hit rate and the number of routes held
+        '''
+        lookups = self.hits + self.persisted_hits + self.misses
+        hit_rate = (self.hits + self.persisted_hits) / lookups if lookups != 0 else 0.0
+        return {"hits": self.hits, "persisted_hits": self.persisted_hits, "misses": self.misses, "hit_rate": hit_rate,
+        "memory_routes": len(self._memory), "persisted_routes": len(self._persisted) + len(self._new_routes)}
@@ -0,0 +1,36 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) #the scripts live in the repository root
+
+from flight_distance import build_coordinate_lookup, distances_from_lookup
+
+
+def make_airports():
+    return pd.DataFrame({
+        "ident": ["X4258", "X4569", "KJFK"],
+        "local_code": ["AAUS", "AAUS", "JFK"],
+        "iata_code": [None, None, "JFK"],
+        "coordinates": ["-97.67, 30.19", "-150.0, 61.17", "-73.78, 40.64"],
+    })
+
+
+def test_override_replaces_code_carried_by_several_rows():
+    airports_df = make_airports()
+    code_to_row = build_coordinate_lookup(airports_df)[0]
+    assert code_to_row["AAUS"] == 1 #without an override the last row carrying the code wins
+
+    code_to_row = build_coordinate_lookup(airports_df, {"AAUS": "X4258"})[0]
+    assert code_to_row["AAUS"] == 0
+
+
+def test_override_reaches_distances():
+    airports_df = make_airports()
+    overridden = distances_from_lookup(["AAUS"], ["JFK"], build_coordinate_lookup(airports_df, {"aaus": "X4258"}))
+    first_row_only = distances_from_lookup(["AAUS"], ["JFK"], build_coordinate_lookup(airports_df.iloc[[0, 2]]))
+    last_row_only = distances_from_lookup(["AAUS"], ["JFK"], build_coordinate_lookup(airports_df.iloc[[1, 2]]))
+    assert np.isclose(overridden[0], first_row_only[0])
+    assert not np.isclose(overridden[0], last_row_only[0])
@@ -0,0 +1,177 @@
+'''
+Streaming reader for business travel files.
+
+pd.read_excel loads every column of the travel workbook into memory even though only the "Origination" and "Destination"
+columns are used, which does not scale to multi-year, multi-campus exports. The functions here read only the requested
+columns in fixed-size chunks of rows so that peak memory stays bounded regardless of the size of the travel file.
+Excel workbooks (.xlsx/.xlsm) are read with openpyxl in read-only mode, skipping rows in which every requested cell is
+blank; .csv and .parquet files are also supported.
+
+Emissions only depend on the route of a flight, so count_travel_routes reduces a travel file, in the same single pass, to
+the number of flights on every route (and on every combination of any other columns needed, e.g. for rollups). Distances
+and emissions are then calculated once per row of that table instead of once per flight, and the file is never read twice.
+
+The module contains the functions read_travel_columns, iter_travel_chunks, unique_travel_routes and count_travel_routes,
+the details of which are provided below.
+
+'''
+
+import os
+
+import pandas as pd
+
+TRAVEL_COLUMNS = ("Origination", "Destination")
+COUNT_COLUMN = "flight_count"
+DEFAULT_CHUNK_ROWS = 50000
+
+
+def _iter_excel_chunks(filename: str, columns: list, chunk_rows: int):
+    from openpyxl import load_workbook #only needed for Excel travel files
+
+    workbook = load_workbook(filename, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True) #same sheet pd.read_excel reads by default
+        header = next(rows, None)
+        if header is None:
+            return
+        header = list(header)
+        missing_columns = [column for column in columns if column not in header]
+        if len(missing_columns) != 0:
+            raise ValueError(f"{filename} is missing the columns {missing_columns}")
+        positions = [header.index(column) for column in columns]
+
+        chunk = []
+        for row in rows:
+            values = [row[position] if position < len(row) else None for position in positions]
+            if all(value is None for value in values): #blank rows, e.g. formatted but empty rows at the end of an export, are
+                continue #skipped as pd.read_excel skips them
+            chunk.append(values)
+            if len(chunk) == chunk_rows:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+        if len(chunk) != 0:
+            yield pd.DataFrame(chunk, columns=columns)
+    finally:
+        workbook.close()
+
+
+def _iter_parquet_chunks(filename: str, columns: list, chunk_rows: int):
+    import pyarrow.parquet as pq #only needed for Parquet travel files
+
+    parquet_file = pq.ParquetFile(filename)
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=columns):
+        yield batch.to_pandas()
+
+
+def read_travel_columns(filename: str) -> list:
+    '''
+    Reads only the header of a travel file, e.g. to check that a file is a travel file before streaming it.
+
+    Inputs:
+        str -- filename: the travel file (.xlsx, .xlsm, .csv or .parquet)
+
+    Returns:
+        The list of column names
+    '''
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in (".xlsx", ".xlsm"):
+        from openpyxl import load_workbook #only needed for Excel travel files
+
+        workbook = load_workbook(filename, read_only=True, data_only=True)
+        try:
+            header = next(workbook.worksheets[0].iter_rows(values_only=True, max_row=1), None)
+        finally:
+            workbook.close()
+        return [] if header is None else list(header)
+    if extension == ".csv":
+        return list(pd.read_csv(filename, nrows=0).columns)
+    if extension in (".parquet", ".pq"):
+        import pyarrow.parquet as pq #only needed for Parquet travel files
+
+        return list(pq.read_schema(filename).names)
+    raise ValueError(f"Unsupported travel file type {extension}; expected .xlsx, .csv or .parquet")
+
+
+def iter_travel_chunks(filename: str, columns: tuple = TRAVEL_COLUMNS, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+    '''
+    Reads a travel file one chunk of rows at a time, keeping only the requested columns.
+
+    Inputs:
+        str -- filename: the travel file (.xlsx, .xlsm, .csv or .parquet)
+        tuple -- columns: the names of the columns to read
+        int -- chunk_rows: the maximum number of rows in each chunk
+
+    Returns:
+        A generator of Pandas data frames with the requested columns, in file order
+    '''
+    columns = list(columns)
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in (".xlsx", ".xlsm"):
+        yield from _iter_excel_chunks(filename, columns, chunk_rows)
+    elif extension == ".csv":
+        for chunk in pd.read_csv(filename, usecols=columns, chunksize=chunk_rows):
+            yield chunk[columns].reset_index(drop=True)
+    elif extension in (".parquet", ".pq"):
+        yield from _iter_parquet_chunks(filename, columns, chunk_rows)
+    else:
+        raise ValueError(f"Unsupported travel file type {extension}; expected .xlsx, .csv or .parquet")
+
+
+def unique_travel_routes(filename: str, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> object:
+    '''
+    Collects the unique origin/destination pairs of a travel file. Travel files repeat the same routes over and over, so
+    this stays small even when the file itself does not fit in memory, and it can be handed to the functions that only
+    need to know which airports appear in the travel file.
+
+    Inputs:
+        str -- filename: the travel file
+        int -- chunk_rows: the maximum number of rows read at once
+
+    Returns:
+        A data frame with unique "Origination" and "Destination" pairs, in order of first occurrence
+    '''
+    routes_df = None
+    for chunk in iter_travel_chunks(filename, TRAVEL_COLUMNS, chunk_rows):
+        chunk_routes_df = chunk.drop_duplicates()
+        if routes_df is None:
+            routes_df = chunk_routes_df
+        else:
+            routes_df = pd.concat([routes_df, chunk_routes_df]).drop_duplicates()
+
+    if routes_df is None: #the travel file has a header but no flights
+        return pd.DataFrame(columns=list(TRAVEL_COLUMNS))
+    return routes_df.reset_index(drop=True)
+
+
+def count_travel_routes(filename: str, columns: tuple = TRAVEL_COLUMNS, chunk_rows: int = DEFAULT_CHUNK_ROWS, prepare: object = None) -> object:
+    '''
+    Counts the flights of a travel file by route in one streaming pass. The counts of each chunk are added to a running
+    table, so memory grows with the number of distinct rows rather than with the size of the travel file.
+
+    Inputs:
+        str -- filename: the travel file
+        tuple -- columns: the columns to read and count by; must include "Origination" and "Destination"
+        int -- chunk_rows: the maximum number of rows read at once
+        obj -- prepare: an optional function applied to every chunk before counting, e.g. to turn a date column into the
+        month it falls in; the counts are by the columns of the chunk it returns
+
+    Returns:
+        A data frame with one row per distinct combination of the counted columns, in order of first occurrence, and the
+        number of flights with that combination in the COUNT_COLUMN column; missing values are counted as their own group
+    '''
+    counts_df = None
+    for chunk in iter_travel_chunks(filename, columns, chunk_rows):
+        if prepare is not None:
+            chunk = prepare(chunk)
+        keys = list(chunk.columns)
+        chunk_counts_df = chunk.groupby(keys, dropna=False, observed=True, sort=False).size().rename(COUNT_COLUMN).reset_index()
+        if counts_df is not None:
+            chunk_counts_df = pd.concat([counts_df, chunk_counts_df]).groupby(keys, dropna=False, observed=True, sort=False)[COUNT_COLUMN].sum().reset_index()
+        counts_df = chunk_counts_df
+
+    if counts_df is None: #the travel file has a header but no flights
+        counts_df = pd.DataFrame(columns=list(columns))
+        counts_df = counts_df if prepare is None else prepare(counts_df)
+        counts_df[COUNT_COLUMN] = pd.Series(dtype="int64")
+    counts_df[COUNT_COLUMN] = counts_df[COUNT_COLUMN].astype("int64")
+    return counts_df
@@ -0,0 +1,258 @@
+'''
+Emissions rollups by traveler, department, month and route, and multi-leg itinerary reconstruction.
+
+summarize_emissions only totals the flights of a travel file by haul band. The functions here work on per-segment results
+that still carry the other travel file columns (Traveler, Department, Departure Date, ...) and total them along any number
+of groupings at once. Every requested rollup is computed from a single groupby pass over the segments: the segments are
+first totalled by the union of all rollup columns, and each rollup is then a regrouping of that much smaller table. Because
+the totals are sums, the same regrouping also combines the totals of several chunks of a travel file: merge_rollups adds
+the rollups of a chunk to running totals, so rollups can be computed while streaming a file that does not fit in memory
+without keeping anything per chunk.
+
+Itineraries are reconstructed from consecutive segments of the same traveler: a leg continues the previous leg's itinerary
+when it departs from the airport the previous leg arrived at, within max_connection of the previous departure.
+
+The module contains the functions add_month_column, rollup_source_columns, prepare_rollup_columns, aggregate_segments,
+combine_rollups, merge_rollups, rollup_emissions, assign_itineraries, summarize_itineraries and write_rollups, the details of which are
+provided below.
+
+'''
+
+import os
+
+import numpy as np
+import pandas as pd
+
+TRAVELER_COLUMN = "Traveler"
+DEPARTMENT_COLUMN = "Department"
+DATE_COLUMN = "Departure Date"
+MONTH_COLUMN = "month"
+ROLLUPS = {
+    "traveler": [TRAVELER_COLUMN],
+    "department": [DEPARTMENT_COLUMN],
+    "month": [MONTH_COLUMN],
+    "route": ["Origination", "Destination"],
+}
+ROLLUP_COLUMNS = ["segments", "flights", "distance_miles", "kg_co2", "tonnes_co2"]
+DEFAULT_MAX_CONNECTION = pd.Timedelta(hours=24)
+
+
+def add_month_column(segments_df: object, date_column: str = DATE_COLUMN) -> object:
+    '''
+    Adds the "month" column (e.g. "2020-07") derived from the departure date.
+
+    Inputs:
+        obj -- segments_df: data frame with the date_column
+        str -- date_column: the departure date column
+
+    Returns:
+        A copy of segments_df with the month column; rows without a valid date have no month
+    '''
+    segments_df = segments_df.copy()
+    segments_df[MONTH_COLUMN] = pd.to_datetime(segments_df[date_column], errors="coerce").dt.strftime("%Y-%m")
+    return segments_df
+
+
+def rollup_source_columns(rollups: dict, date_column: str = DATE_COLUMN) -> list:
+    '''
+    Inputs:
+        dict -- rollups: rollup name -> the columns it groups by
+        str -- date_column: the departure date column, read in place of the derived month column
+
+    Returns:
+        The travel file columns needed to compute the rollups, in order and without duplicates
+    '''
+    columns = [date_column if column == MONTH_COLUMN else column for keys in rollups.values() for column in keys]
+    return list(dict.fromkeys(columns))
+
+
+def prepare_rollup_columns(travel_df: object, rollups: dict, date_column: str = DATE_COLUMN) -> object:
+    '''
+    Turns travel file rows read with rollup_source_columns into the columns the rollups group by: the month column is
+    derived from the departure date, which is then dropped unless a rollup groups by it directly. Counting rows by month
+    rather than by day keeps the route counts of travel_reader.count_travel_routes small.
+
+    Inputs:
+        obj -- travel_df: travel file rows with the columns returned by rollup_source_columns (and any others)
+        dict -- rollups: rollup name -> the columns it groups by
+        str -- date_column: the departure date column
+
+    Returns:
+        A data frame with the other columns of travel_df and, if a rollup needs it, the month column
+    '''
+    keys = {column for columns in rollups.values() for column in columns}
+    if MONTH_COLUMN not in keys:
+        return travel_df
+    travel_df = add_month_column(travel_df, date_column)
+    return travel_df if date_column in keys else travel_df.drop(columns=[date_column])
+
+
+def aggregate_segments(segments_df: object, keys: list, weights: object = None) -> object:
+    '''
+    Totals per-segment results by the given columns in one groupby pass.
+
+    Inputs:
+        obj -- segments_df: per-segment results with the key columns and the kg_co2, tonnes_co2 and distance_miles columns
+        list -- keys: the columns to group by; segments with a missing key value are kept as their own group
+        obj -- weights: optional array-like with the number of segments each row stands for, e.g. when segments_df holds the
+        counts of travel_reader.count_travel_routes; every row is one segment by default
+
+    Returns:
+        A data frame with the key columns followed by segments (every segment), flights (segments with emissions),
+        distance_miles, kg_co2 and tonnes_co2
+    '''
+    weights = np.ones(len(segments_df), dtype=np.int64) if weights is None else np.asarray(weights, dtype=np.int64)
+    weighted_df = segments_df[list(keys)].copy()
+    weighted_df["segments"] = weights
+    weighted_df["flights"] = np.where(segments_df["kg_co2"].notna().to_numpy(), weights, 0)
+    for column in ("distance_miles", "kg_co2", "tonnes_co2"):
+        weighted_df[column] = segments_df[column].to_numpy() * weights
+    aggregate_df = weighted_df.groupby(list(keys), dropna=False, observed=True, sort=False)[ROLLUP_COLUMNS].sum()
+    return aggregate_df.reset_index()
+
+
+def combine_rollups(aggregate_df: object, rollups: dict) -> dict:
+    '''
+    Regroups the output of aggregate_segments into each rollup. aggregate_df may be the concatenated aggregates of several
+    chunks or files, which are added together.
+
+    Inputs:
+        obj -- aggregate_df: totals by (at least) every column used in rollups
+        dict -- rollups: rollup name -> the columns it groups by
+
+    Returns:
+        A dictionary of rollup name -> data frame indexed by the rollup columns with the ROLLUP_COLUMNS totals, largest
+        kg_co2 first
+    '''
+    rollup_dfs = {}
+    for name, keys in rollups.items():
+        rollup_df = aggregate_df.groupby(list(keys), dropna=False, observed=True)[ROLLUP_COLUMNS].sum()
+        rollup_df[["segments", "flights"]] = rollup_df[["segments", "flights"]].astype(np.int64)
+        rollup_dfs[name] = rollup_df.sort_values("kg_co2", ascending=False, kind="stable")
+    return rollup_dfs
+
+
+def merge_rollups(rollup_dfs: dict, new_rollup_dfs: dict, rollups: dict) -> dict:
+    '''
+    Adds one set of rollup totals to another, e.g. the rollups of a travel file chunk to the running totals of the chunks
+    before it. Each merged rollup has one row per key, so its size does not grow with the number of chunks.
+
+    Inputs:
+        dict -- rollup_dfs: rollup name -> data frame, as returned by combine_rollups; empty before the first chunk
+        dict -- new_rollup_dfs: rollup name -> data frame to add, as returned by combine_rollups
+        dict -- rollups: rollup name -> the columns it groups by
+
+    Returns:
+        A dictionary of rollup name -> data frame, as returned by combine_rollups
+    '''
+    merged_dfs = {}
+    for name, keys in rollups.items():
+        frames = [rollup_df.reset_index() for rollup_df in (rollup_dfs.get(name), new_rollup_dfs[name]) if rollup_df is not None]
+        merged_dfs.update(combine_rollups(pd.concat(frames), {name: keys}))
+    return merged_dfs
+
+
+def rollup_emissions(segments_df: object, rollups: dict = None, date_column: str = DATE_COLUMN) -> dict:
+    '''
+    Computes every rollup of the per-segment results with a single groupby pass over the segments.
+
+    Inputs:
+        obj -- segments_df: per-segment results carrying the travel file columns used by the rollups
+        dict -- rollups: rollup name -> the columns it groups by; ROLLUPS by default
+        str -- date_column: the departure date column the month rollup is derived from
+
+    Returns:
+        A dictionary of rollup name -> data frame, as returned by combine_rollups
+    '''
+    if rollups is None:
+        rollups = ROLLUPS
+    keys = list(dict.fromkeys(column for columns in rollups.values() for column in columns))
+    if MONTH_COLUMN in keys and MONTH_COLUMN not in segments_df.columns:
+        segments_df = add_month_column(segments_df, date_column)
+    return combine_rollups(aggregate_segments(segments_df, keys), rollups)
+
+
+def assign_itineraries(segments_df: object, traveler_column: str = TRAVELER_COLUMN, date_column: str = DATE_COLUMN,
+max_connection: object = DEFAULT_MAX_CONNECTION) -> object:
+    '''
+    Groups consecutive segments of each traveler into itineraries. Segments are ordered by traveler and departure date
+    (ties keep their order in the travel file) and a new itinerary starts whenever the traveler changes, the segment does
+    not depart from the previous segment's destination, or it departs more than max_connection after the previous segment.
+
+    Inputs:
+        obj -- segments_df: per-segment results with the Origination, Destination, traveler_column and date_column columns
+        str -- traveler_column: the column identifying the traveler
+        str -- date_column: the departure date column; None to rely on travel file order alone
+        obj -- max_connection: the longest layover, as a pandas Timedelta, that still continues an itinerary
+
+    Returns:
+        A copy of segments_df with the columns itinerary (numbered from 0 in traveler and date order) and leg (numbered from 1)
+    '''
+    sort_columns = [traveler_column] if date_column is None else [traveler_column, date_column]
+    ordered_df = segments_df[sort_columns + ["Origination", "Destination"]].reset_index(drop=True) #index = position in segments_df
+    if date_column is not None:
+        ordered_df[date_column] = pd.to_datetime(ordered_df[date_column], errors="coerce")
+    ordered_df = ordered_df.sort_values(sort_columns, kind="stable", na_position="last")
+
+    previous_df = ordered_df.shift(1)
+    new_itinerary = (ordered_df[traveler_column].ne(previous_df[traveler_column])
+    | ordered_df["Origination"].ne(previous_df["Destination"]))
+    if date_column is not None:
+        layover = ordered_df[date_column] - previous_df[date_column]
+        new_itinerary = new_itinerary | ~(layover <= max_connection) #a missing date never continues an itinerary
+
+    itinerary = new_itinerary.to_numpy().cumsum() - 1
+    legs = pd.Series(itinerary).groupby(itinerary).cumcount().to_numpy() + 1
+
+    positions = ordered_df.index.to_numpy()
+    segments_df = segments_df.copy()
+    segments_df["itinerary"] = np.empty(len(positions), dtype=np.int64)
+    segments_df["leg"] = np.empty(len(positions), dtype=np.int64)
+    segments_df.iloc[positions, segments_df.columns.get_indexer(["itinerary", "leg"])] = np.column_stack([itinerary, legs])
+    return segments_df
+
+
+def summarize_itineraries(segments_df: object, traveler_column: str = TRAVELER_COLUMN) -> object:
+    '''
+    Totals the segments of each itinerary.
+
+    Inputs:
+        obj -- segments_df: per-segment results returned by assign_itineraries
+        str -- traveler_column: the column identifying the traveler
+
+    Returns:
+        A data frame indexed by itinerary with the traveler, first origin, final destination, number of legs, and the
+        flights, distance_miles, kg_co2 and tonnes_co2 totals
+    '''
+    ordered_df = segments_df.sort_values(["itinerary", "leg"])
+    itinerary_df = ordered_df.groupby("itinerary").agg(
+        traveler=(traveler_column, "first"),
+        origin=("Origination", "first"),
+        destination=("Destination", "last"),
+        legs=("leg", "size"),
+        flights=("kg_co2", "count"),
+        distance_miles=("distance_miles", "sum"),
+        kg_co2=("kg_co2", "sum"),
+        tonnes_co2=("tonnes_co2", "sum"),
+    )
+    return itinerary_df
+
+
+def write_rollups(rollup_dfs: dict, output_dir: str = ".") -> list:
+    '''
+    Saves each rollup as <output_dir>/rollup_<name>.csv.
+
+    Inputs:
+        dict -- rollup_dfs: rollup name -> data frame, as returned by rollup_emissions
+        str -- output_dir: the directory to write to; it is created if it does not exist
+
+    Returns:
+        The list of files written
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    filenames = []
+    for name, rollup_df in rollup_dfs.items():
+        filename = os.path.join(output_dir, f"rollup_{name}.csv")
+        rollup_df.to_csv(filename)
+        filenames.append(filename)
+    return filenames